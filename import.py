@@ -56,17 +56,28 @@ wordpress
 from abc import ABC, abstractmethod
 import argparse
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from itertools import chain
+import datetime
+import html
 from html.parser import HTMLParser
 import pathlib
 import re
+import sqlite3
+import sys
 import textwrap
+import time
 import urllib.parse
 import urllib.request
 import logging
+import json
+import mmap
+import os
 
 from xml.etree import ElementTree as ET
 
+from rstblog_content.dimensions import dimension_options, probe
+
 _log = logging.getLogger(__name__)
 
 XML_NAMESPACES = {
@@ -112,8 +123,21 @@ class Item(ABC):
     def __init__(self, el):
         self.title = el.find("title").text
         self.link = el.find("link").text
+        self.guid = el.findtext("guid")
         self.post_type = el.find("wp:post_type", XML_NAMESPACES).text
         self.status = el.find("wp:status", XML_NAMESPACES).text
+        # Used to pick the newest version of an item appearing in several
+        # export files. These are all "YYYY-MM-DD HH:MM:SS", so they compare
+        # correctly as strings.
+        self.modified = next(
+            (
+                v
+                for k in ("post_modified_gmt", "post_modified", "post_date")
+                if (v := el.findtext(f"wp:{k}", None, XML_NAMESPACES))
+                and not v.startswith("0000")
+            ),
+            "",
+        )
 
     @property
     def discard(self):
@@ -151,6 +175,8 @@ class Attachment(Item):
 class AttachmentRef:
     def __init__(self, url):
         self.src = url
+        # Intrinsic (width, height) of downloaded images
+        self.size = None
 
     @property
     def src(self):
@@ -392,8 +418,9 @@ class ImgTag(TagHandler):
         lines = [f".. {directive}:: {self.image.src}"]
         if target:
             lines.append(f"   :target: {target.src}")
-        if width:
-            lines.append(f"   :width: {width}")
+        options = {"width": width} if width else {}
+        options.update(dimension_options(options, self.image.size))
+        lines.extend(f"   :{k}: {v}" for k, v in options.items())
         if align:
             lines.append(f"   :align: {align}")
         if caption:
@@ -821,16 +848,245 @@ class DropMeTag(TagHandler):
         return ""
 
 
-class WordpressToRst(HTMLParser):
-    def __init__(self):
+class HtmlBackend(ABC):
+    """
+    Tokenizes HTML on behalf of a handler (WordpressToRst), calling its
+    handle_starttag, handle_startendtag, handle_endtag, handle_data and
+    handle_comment methods exactly as html.parser.HTMLParser would. getpos()
+    returns the position of the token currently being handled.
+    """
+
+    BACKENDS = {}
+
+    @classmethod
+    def register_backend(cls, name):
+        def wrapper(fn):
+            cls.BACKENDS[name] = fn
+            return fn
+
+        return wrapper
+
+    @classmethod
+    def create(cls, name, handler):
+        backend = cls.BACKENDS.get(name, None)
+        if backend is None:
+            raise ValueError(f"No HTML backend named {name}")
+        return backend(handler)
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    @abstractmethod
+    def feed(self, data):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def getpos(self):
+        pass
+
+
+class ForwardingParser(HTMLParser):
+    """
+    HTMLParser which hands every callback off to another object
+    """
+
+    def __init__(self, handler):
         super().__init__()
+        self.handler = handler
+
+    def handle_starttag(self, tag, attrs):
+        self.handler.handle_starttag(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handler.handle_startendtag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.handler.handle_endtag(tag)
+
+    def handle_data(self, data):
+        self.handler.handle_data(data)
+
+    def handle_comment(self, data):
+        self.handler.handle_comment(data)
+
+
+@HtmlBackend.register_backend("stdlib")
+class StdlibBackend(HtmlBackend):
+    def __init__(self, handler):
+        super().__init__(handler)
+        self.parser = ForwardingParser(handler)
+
+    def feed(self, data):
+        self.parser.feed(data)
+
+    def close(self):
+        self.parser.close()
+
+    def getpos(self):
+        return self.parser.getpos()
+
+
+@HtmlBackend.register_backend("regex")
+class RegexBackend(HtmlBackend):
+    """
+    Tokenizes the subset of HTML that wordpress actually emits (plain tags,
+    quoted attributes, comments) with a single compiled regex, which is much
+    faster than HTMLParser's per-token bookkeeping on large bodies.
+
+    Anything outside of that subset (declarations, script/style, unusual
+    attribute syntax, etc) is handed off to an HTMLParser from that point on,
+    starting at the same position. This keeps the resulting callbacks
+    identical to the stdlib backend.
+    """
+
+    # Text runs and every supported token. Separators within tags are
+    # deliberately limited to ASCII whitespace so that anything HTMLParser
+    # would split differently fails to match and falls back.
+    TOKEN_RE = re.compile(
+        r"""(?P<text>[^<]+)
+          | <(?P<start>[a-zA-Z][-.a-zA-Z0-9:_]*)
+            (?P<attrs>(?:[ \t\n\r\f]+[^\s/>"'=]+
+                (?:[ \t\n\r\f]*=[ \t\n\r\f]*
+                    (?:"[^"]*"|'[^']*'|[^\s"'>=][^\s"'>]*))?)*)
+            [ \t\n\r\f]*(?P<close>/?)>
+          | </(?P<end>[a-zA-Z][-.a-zA-Z0-9:_]*)[ \t\n\r\f]*>
+          | <!--(?P<comment>(?:[^-]|-(?!-))*)-->
+          | <(?P<stray>)(?=[^a-zA-Z/!?])
+        """,
+        re.VERBOSE,
+    )
+    ATTR_RE = re.compile(
+        r"""[ \t\n\r\f]+([^\s/>"'=]+)
+        (?:[ \t\n\r\f]*=[ \t\n\r\f]*("[^"]*"|'[^']*'|[^\s"'>]+))?""",
+        re.VERBOSE,
+    )
+    CHARREF_END_RE = re.compile(r"[\s;]")
+    # Elements whose content HTMLParser doesn't tokenize
+    CDATA_ELEMENTS = ("script", "style")
+
+    def __init__(self, handler):
+        super().__init__(handler)
+        self.rawdata = ""
+        self.lineno = 1
+        self.offset = 0
+        self.fallback = None
+
+    def getpos(self):
+        if self.fallback is not None:
+            return self.fallback.getpos()
+        return self.lineno, self.offset
+
+    def feed(self, data):
+        if self.fallback is not None:
+            self.fallback.feed(data)
+            return
+        self.rawdata += data
+        self._goahead(False)
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
+            return
+        self._goahead(True)
+        if self.fallback is not None:
+            self.fallback.close()
+
+    def _fall_back(self, i):
+        _log.debug(f"Falling back to HTMLParser at line {self.lineno}")
+        self.fallback = ForwardingParser(self.handler)
+        self.fallback.lineno = self.lineno
+        self.fallback.offset = self.offset
+        rawdata, self.rawdata = self.rawdata[i:], ""
+        self.fallback.feed(rawdata)
+
+    def _goahead(self, end):
+        rawdata = self.rawdata
+        handler = self.handler
+        unescape = html.unescape
+        i = 0
+        n = len(rawdata)
+        held = False
+        for m in self.TOKEN_RE.finditer(rawdata):
+            if m.start() != i:
+                # Nothing we support matched at i
+                break
+            kind = m.lastgroup
+            j = m.end()
+            if kind == "text":
+                if j == n and not end:
+                    # Same as HTMLParser: hold back text which may end in half
+                    # of a character reference until more arrives
+                    amppos = rawdata.rfind("&", max(i, n - 34))
+                    if amppos >= 0 and not self.CHARREF_END_RE.search(rawdata, amppos):
+                        held = True
+                        break
+                text = m.group("text")
+                handler.handle_data(unescape(text) if "&" in text else text)
+            elif kind == "close":
+                tag = m.group("start").lower()
+                if tag in self.CDATA_ELEMENTS:
+                    break
+                attrs = []
+                if m.group("attrs"):
+                    for a in self.ATTR_RE.finditer(m.group("attrs")):
+                        name, value = a.group(1, 2)
+                        if value is not None and value[:1] in ("'", '"'):
+                            value = value[1:-1]
+                        if value:
+                            value = unescape(value)
+                        attrs.append((name.lower(), value))
+                if m.group("close"):
+                    handler.handle_startendtag(tag, attrs)
+                else:
+                    handler.handle_starttag(tag, attrs)
+            elif kind == "end":
+                handler.handle_endtag(m.group("end").lower())
+            elif kind == "comment":
+                handler.handle_comment(m.group("comment"))
+            else:
+                handler.handle_data("<")
+            # The handler calls getpos() during the callbacks above, so the
+            # position is only advanced afterwards. This is the same
+            # computation as ParserBase.updatepos.
+            nlines = rawdata.count("\n", i, j)
+            if nlines:
+                self.lineno += nlines
+                self.offset = j - (rawdata.rindex("\n", i, j) + 1)
+            else:
+                self.offset += j - i
+            i = j
+        if i < n and not held and (end or rawdata.find(">", i) >= 0):
+            # An unsupported (rather than incomplete) construct
+            self._fall_back(i)
+            return
+        self.rawdata = rawdata[i:]
+
+
+class WordpressToRst:
+    DEFAULT_BACKEND = "regex"
+
+    def __init__(self, backend=DEFAULT_BACKEND):
         self._last_data = ""
         self.stack = deque()
         self.content = []
+        self.parser = HtmlBackend.create(backend, self)
+
+    def feed(self, data):
+        self.parser.feed(data)
+
+    def getpos(self):
+        return self.parser.getpos()
 
     def _tag_kwargs(self, tag, attrs):
         kwargs = {}
-        if m := re.search(r"\[caption\s([^\]]+)\]\s*$", self._last_data):
+        # The substring check skips the regex for the vast majority of tags
+        if "[caption" in self._last_data and (
+            m := re.search(r"\[caption\s([^\]]+)\]\s*$", self._last_data)
+        ):
             kwargs["caption"] = dict(
                 [
                     (kv.group(1), kv.group(2))
@@ -871,7 +1127,8 @@ class WordpressToRst(HTMLParser):
 
     def handle_data(self, data):
         self._last_data = data
-        for m in re.finditer(r"\[(/?)(\w+)[^\]]*\]", data):
+        bbcode = re.finditer(r"\[(/?)(\w+)[^\]]*\]", data) if "[" in data else []
+        for m in bbcode:
             # Remove all bbcode-style things
             if m.group(2) == "caption":
                 if m.group(1) == "/":
@@ -905,7 +1162,7 @@ class WordpressToRst(HTMLParser):
         return decls
 
     def close(self):
-        super().close()
+        self.parser.close()
         if len(self.stack):
             raise ValueError("Unclosed tags remain at the end of HTML")
         return "".join([t.to_rst() for t in self.content])
@@ -947,7 +1204,7 @@ class Content(Item):
             decl.append("   :tags: " + ", ".join(tags))
         return "\n".join(decl)
 
-    def process(self, attachments):
+    def process(self, attachments, backend=WordpressToRst.DEFAULT_BACKEND):
         # small worry here about path traversal...but whatever, this script
         # isn't ran automatically
         base_dir = pathlib.Path.cwd()
@@ -955,7 +1212,7 @@ class Content(Item):
         output_dir.mkdir(parents=True, exist_ok=True)
         index_path = output_dir / "index.rst"
         # Process the HTML content into RST
-        content = WordpressToRst()
+        content = WordpressToRst(backend)
         content.feed(self.content_raw)
         attachments.process(content.attachments, output_dir)
         decls = "".join(content.declarations)
@@ -973,7 +1230,6 @@ class Post(Content):
         super().__init__(el)
         from dateutil import parser
 
-        self.content = el.find("content:encoded", XML_NAMESPACES).text
         self.date = parser.parse(el.find("wp:post_date", XML_NAMESPACES).text)
         self.name = el.find("wp:post_name", XML_NAMESPACES).text
         self.title = el.find("title", XML_NAMESPACES).text
@@ -998,7 +1254,6 @@ class Page(Content):
         super().__init__(el)
         from dateutil import parser
 
-        self.content = el.find("content:encoded", XML_NAMESPACES).text
         self.date = parser.parse(el.find("wp:post_date", XML_NAMESPACES).text)
         self.name = el.find("wp:post_name", XML_NAMESPACES).text
         self.title = el.find("title", XML_NAMESPACES).text
@@ -1029,50 +1284,519 @@ class AttachmentRegistry:
                     f"Downloaded attachment {attachment.guid} to {output_dir / name}"
                 )
                 a.src = name
+                a.size = probe(output_dir / name)
             else:
                 _log.debug(f"Clearing src for {a.src}, attachment not found")
                 a.src = None
 
+    def lookup(self, key):
+        return self.registry.get(key, None)
+
     def find(self, link):
         # First attempt to find the attachment by the link naturally
-        if r := self.registry.get(link, None):
+        if r := self.lookup(link):
             return r
         # The link may be a resized version. Strip off any resizing information
         # from the end.
         _, _, path, _, _, _ = urllib.parse.urlparse(link)
         if (m := re.search(r"/.+(-\d+x\d+)\.\w+$", path)) and (
-            r := self.registry.get(link.replace(m.group(1), ""), None)
+            r := self.lookup(link.replace(m.group(1), ""))
         ):
             return r
         _log.warning(f'Unable to find attachment for "{link}"')
         return None
 
 
-def load_rss(file):
+def tree_signature(value):
+    """
+    Comparable representation of a parsed TagHandler tree, including the
+    positions of every element
+    """
+    if isinstance(value, (TagHandler, TextBody, PostBreak, AttachmentRef)):
+        return (
+            type(value).__name__,
+            tuple(sorted((k, tree_signature(v)) for k, v in vars(value).items())),
+        )
+    if isinstance(value, (list, tuple, deque)):
+        return tuple(tree_signature(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, tree_signature(v)) for k, v in value.items()))
+    return value
+
+
+def compare_backends(items):
+    """
+    Converts every post and page to ReST with each HTML backend, reporting any
+    which produce differing TagHandler trees or ReST along with the time each
+    backend took to parse and convert them. Attachments aren't downloaded, so
+    images keep the paths of their original URLs.
+    """
+    elapsed = dict((b, 0.0) for b in HtmlBackend.BACKENDS)
+    mismatches = 0
+    for i in (i for i in items if isinstance(i, Content)):
+        signatures = {}
+        for backend in HtmlBackend.BACKENDS:
+            start = time.perf_counter()
+            content = WordpressToRst(backend)
+            try:
+                content.feed(i.content_raw)
+                rst = content.close()
+            except ValueError as e:
+                # Both backends should fail in the same way on bad content
+                rst = (str(e), content.getpos())
+            elapsed[backend] += time.perf_counter() - start
+            tree = (content.content, content.stack)
+            signatures[backend] = (tree_signature(tree), rst)
+        if len(set(signatures.values())) > 1:
+            _log.error(f"HTML backends disagree on {i.name}")
+            mismatches += 1
+    for backend, seconds in elapsed.items():
+        _log.info(f"{backend}: {seconds * 1000:.1f}ms to parse and convert to ReST")
+    return mismatches
+
+
+def parse_rss(file):
     tree = ET.parse(file)
     root = tree.getroot()
     channel = root.find("channel")
     categories = [Category(el) for el in channel.findall("wp:category", XML_NAMESPACES)]
     items = [Item.from_xml(el) for el in channel.findall("item")]
-    items = [i for i in items if not i.discard]
-    attachments = AttachmentRegistry(items)
+    _log.info(f"Loaded {len(items)} items from {file}")
+    return items
+
+
+def find_exports(paths):
+    """
+    Expands the passed paths into export files, searching directories for
+    XML files
+    """
+    for path in (pathlib.Path(p) for p in paths):
+        if path.is_dir():
+            yield from sorted(path.glob("*.xml"))
+        else:
+            yield path
+
+
+def deduplicate(items):
+    """
+    Keeps only the newest version of each item that appears more than once
+    (by GUID). When the versions are equally new, the later file wins.
+    """
+    newest = {}
+    unique = []
+    for i in items:
+        if i.guid is None:
+            unique.append(i)
+        elif i.guid not in newest or i.modified >= newest[i.guid].modified:
+            newest[i.guid] = i
+    return unique + list(newest.values())
+
+
+class ExportStore:
+    """
+    SQLite database holding the items of one or more exports, so that
+    individual posts can be converted again without re-parsing the XML. Each
+    item is kept as its raw XML and recreated with Item.from_xml.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS exports (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY,
+            guid TEXT UNIQUE,
+            post_id TEXT,
+            slug TEXT,
+            post_type TEXT NOT NULL,
+            status TEXT,
+            date TEXT,
+            modified TEXT NOT NULL,
+            xml TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS items_slug ON items (slug);
+        CREATE INDEX IF NOT EXISTS items_date ON items (date);
+        CREATE INDEX IF NOT EXISTS items_post_type ON items (post_type);
+        CREATE TABLE IF NOT EXISTS attachment_keys (
+            key TEXT PRIMARY KEY,
+            guid TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS terms (
+            kind TEXT NOT NULL,
+            term_id TEXT,
+            slug TEXT NOT NULL,
+            name TEXT,
+            parent TEXT,
+            PRIMARY KEY (kind, slug)
+        );
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+        for prefix, uri in XML_NAMESPACES.items():
+            ET.register_namespace(prefix, uri)
+
+    def ingest(self, file):
+        """
+        Loads an export into the store unless it is unchanged since it was
+        last ingested. Items already stored from another export are only
+        replaced by newer versions.
+        """
+        stat = file.stat()
+        path = str(file.resolve())
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        row = self.db.execute(
+            "SELECT size, mtime FROM exports WHERE path = ?", (path,)
+        ).fetchone()
+        if row == stamp:
+            _log.info(f"{file} is unchanged since it was ingested")
+            return
+        _log.info(f"Ingesting {file}")
+        count = 0
+        with self.db:
+            for _, el in ET.iterparse(file):
+                if el.tag == "item":
+                    self._put_item(el)
+                    count += 1
+                elif el.tag == f"{{{XML_NAMESPACES['wp']}}}category":
+                    c = Category(el)
+                    self._put_term("category", c.id, c.nicename, c.name, c.parent_id)
+                elif el.tag == f"{{{XML_NAMESPACES['wp']}}}tag":
+                    t = Tag(el)
+                    self._put_term("tag", t.id, t.slug, t.name, None)
+                else:
+                    continue
+                # Keep memory bounded on very large exports
+                el.clear()
+            self.db.execute(
+                "INSERT OR REPLACE INTO exports VALUES (?, ?, ?)", (path, *stamp)
+            )
+        _log.info(f"Ingested {count} items from {file}")
+
+    def _put_item(self, el):
+        item = Item.from_xml(el)
+        el.tail = None
+        self.db.execute(
+            """
+            INSERT INTO items
+                (guid, post_id, slug, post_type, status, date, modified, xml)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (guid) DO UPDATE SET
+                post_id = excluded.post_id,
+                slug = excluded.slug,
+                post_type = excluded.post_type,
+                status = excluded.status,
+                date = excluded.date,
+                modified = excluded.modified,
+                xml = excluded.xml
+            WHERE excluded.modified >= items.modified
+            """,
+            (
+                item.guid,
+                el.findtext("wp:post_id", None, XML_NAMESPACES),
+                el.findtext("wp:post_name", None, XML_NAMESPACES),
+                item.post_type,
+                item.status,
+                el.findtext("wp:post_date", None, XML_NAMESPACES),
+                item.modified,
+                ET.tostring(el, encoding="unicode"),
+            ),
+        )
+        if isinstance(item, Attachment):
+            self.db.executemany(
+                "INSERT OR REPLACE INTO attachment_keys VALUES (?, ?)",
+                ((k, item.guid) for k in set(item.keys)),
+            )
+
+    def _put_term(self, kind, term_id, slug, name, parent):
+        self.db.execute(
+            "INSERT OR REPLACE INTO terms VALUES (?, ?, ?, ?, ?)",
+            (kind, term_id, slug, name, parent),
+        )
+
+    def items(self, only=None, since=None):
+        """
+        Yields the published content items with the passed slugs and/or posted
+        on or after the passed date
+        """
+        content_types = [t for t, h in Item.HANDLERS.items() if issubclass(h, Content)]
+        query = [
+            "SELECT xml FROM items",
+            f"WHERE post_type IN ({', '.join('?' * len(content_types))})",
+            "AND status IN ('publish', 'inherit')",
+        ]
+        params = list(content_types)
+        if only is not None:
+            query.append(f"AND slug IN ({', '.join('?' * len(only))})")
+            params.extend(only)
+        if since is not None:
+            query.append("AND date >= ?")
+            params.append(since.isoformat())
+        query.append("ORDER BY id")
+        for (xml,) in self.db.execute(" ".join(query), params):
+            yield Item.from_xml(ET.fromstring(xml))
+
+    def attachment(self, key):
+        row = self.db.execute(
+            "SELECT xml FROM items JOIN attachment_keys USING (guid) WHERE key = ?",
+            (key,),
+        ).fetchone()
+        return Item.from_xml(ET.fromstring(row[0])) if row else None
+
+
+class StoredAttachmentRegistry(AttachmentRegistry):
+    """
+    Finds attachments in an ExportStore instead of holding all of them
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def lookup(self, key):
+        return self.store.attachment(key)
+
+
+class ItemIndex:
+    """
+    Byte range of every <item> in an export, keyed by slug, post id and GUID,
+    so that single items can be parsed without parsing the whole export. The
+    index is saved next to the export and rebuilt whenever the export's size
+    or mtime changes.
+    """
+
+    VERSION = 1
+    FIELDS = (
+        "guid",
+        "link",
+        "post_name",
+        "post_id",
+        "post_type",
+        "status",
+        "post_date",
+    )
+    # Items and the fields we index in them. CDATA sections (which hold the
+    # post content) are matched whole so that nothing inside them is mistaken
+    # for markup.
+    TOKEN_RE = re.compile(
+        rb"<!\[CDATA\[.*?\]\]>|(?P<item><item>)|(?P<end></item>)"
+        rb"|<(?P<field>guid|link|wp:post_name|wp:post_id|wp:post_type|wp:status"
+        rb"|wp:post_date)(?:\s[^>]*)?>"
+        rb"(?:<!\[CDATA\[(?P<cdata>.*?)\]\]>|(?P<text>[^<]*))</(?P=field)>",
+        re.S,
+    )
+    HEADER_RE = re.compile(rb"<rss\b[^>]*>")
+
+    def __init__(self, file):
+        self.file = pathlib.Path(file)
+        self.path = self.file.with_name(f"{self.file.name}.index.json")
+        with open(self.file, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index["version"] != self.VERSION or index["stamp"] != stamp:
+                raise ValueError("stale index")
+        except (FileNotFoundError, ValueError, KeyError):
+            _log.info(f"Indexing {self.file}")
+            index = dict(self.scan(), version=self.VERSION, stamp=stamp)
+            with open(self.path, "w") as f:
+                json.dump(index, f)
+        self.header_end = index["header_end"]
+        self.items = index["items"]
+        # Maps (field, value) to the numbers of the items having it. An export
+        # may contain several versions of the same item.
+        self.keys = {}
+        for n, entry in enumerate(self.items):
+            keys = [(f, entry[f]) for f in ("post_name", "post_id", "guid")]
+            if entry["post_type"] == "attachment":
+                # The same keys as Attachment.keys
+                for url in (entry["link"], entry["guid"]):
+                    _, _, path, _, _, _ = urllib.parse.urlparse(url)
+                    keys.extend((("attachment", url), ("attachment", path)))
+            for key in set(keys):
+                self.keys.setdefault(key, []).append(n)
+
+    def scan(self):
+        header = self.HEADER_RE.search(self.data)
+        if header is None:
+            raise ValueError(f"{self.file} is not an RSS file")
+        items = []
+        entry = None
+        for m in self.TOKEN_RE.finditer(self.data, header.end()):
+            if m.group("item"):
+                entry = dict.fromkeys(self.FIELDS)
+                entry["start"] = m.start()
+            elif m.group("end") and entry is not None:
+                entry["end"] = m.end()
+                items.append(entry)
+                entry = None
+            elif (field := m.group("field")) and entry is not None:
+                field = field.decode("ascii").removeprefix("wp:")
+                if entry[field] is None:
+                    if (value := m.group("cdata")) is None:
+                        value = html.unescape(m.group("text").decode("utf-8"))
+                    else:
+                        value = value.decode("utf-8")
+                    entry[field] = value
+        return {"header_end": header.end(), "items": items}
+
+    def item(self, n):
+        """
+        Parses a single item. It is wrapped in the export's own header so that
+        the encoding and namespace declarations still apply.
+        """
+        entry = self.items[n]
+        fragment = b"".join(
+            (
+                self.data[: self.header_end],
+                self.data[entry["start"] : entry["end"]],
+                b"</rss>",
+            )
+        )
+        return Item.from_xml(ET.fromstring(fragment).find("item"))
+
+    def find(self, field, value):
+        """
+        Parses every item with the passed value of an indexed field
+        """
+        return [self.item(n) for n in self.keys.get((field, value), [])]
+
+    def select(self, only=None, since=None):
+        """
+        Parses the content items with the passed slugs and/or posted on or
+        after the passed date. Drafts are included, so that they can replace
+        older versions of an item when deduplicating.
+        """
+        content_types = [t for t, h in Item.HANDLERS.items() if issubclass(h, Content)]
+        if only is not None:
+            found = (self.keys.get(("post_name", slug), []) for slug in only)
+            candidates = sorted(chain.from_iterable(found))
+        else:
+            candidates = range(len(self.items))
+        for n in candidates:
+            entry = self.items[n]
+            if entry["post_type"] not in content_types:
+                continue
+            if since is not None and (entry["post_date"] or "") < since.isoformat():
+                continue
+            yield self.item(n)
+
+
+class IndexedAttachmentRegistry(AttachmentRegistry):
+    """
+    Finds attachments through the item indexes of the exports, parsing only
+    those which are used
+    """
+
+    def __init__(self, indexes):
+        # Later exports take precedence, as they do when deduplicating
+        self.indexes = list(reversed(indexes))
+
+    def lookup(self, key):
+        found = chain.from_iterable(i.find("attachment", key) for i in self.indexes)
+        return max(found, key=lambda a: a.modified, default=None)
+
+
+def load_rss(
+    files,
+    backend=WordpressToRst.DEFAULT_BACKEND,
+    compare=False,
+    store=None,
+    only=None,
+    since=None,
+):
+    files = list(find_exports(files))
+    if store is not None:
+        store = ExportStore(store)
+        for f in files:
+            store.ingest(f)
+        items = list(store.items(only, since))
+        attachments = StoredAttachmentRegistry(store)
+        _log.info(f"{len(items)} items to import")
+    elif only is not None or since is not None:
+        # Only the selected items need to be parsed, which the item index of
+        # each export lets us find without parsing the rest
+        indexes = [ItemIndex(f) for f in files]
+        items = deduplicate(chain.from_iterable(i.select(only, since) for i in indexes))
+        items = [i for i in items if not i.discard]
+        attachments = IndexedAttachmentRegistry(indexes)
+        _log.info(f"{len(items)} items to import from {len(files)} files")
+    else:
+        # Each file is parsed in its own process. Items from all of them share
+        # one attachment registry, as posts and their attachments may be split
+        # between files.
+        with ProcessPoolExecutor() as pool:
+            items = list(chain.from_iterable(pool.map(parse_rss, files)))
+        count = len(items)
+        # Deduplicate first, so that an item whose newest version isn't
+        # published is left out rather than imported from an older version
+        items = [i for i in deduplicate(items) if not i.discard]
+        attachments = AttachmentRegistry(items)
+        _log.info(f"{len(items)} items to import from {count} in {len(files)} files")
+    if compare:
+        return compare_backends(items)
     for i in (i for i in items if isinstance(i, Content)):
         _log.info(f"Processing {i.name}")
-        i.process(attachments)
+        i.process(attachments, backend)
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("-v", "--verbose", action="store_true")
-    parser.add_argument("rss", help="Path to RSS XML file")
+    parser.add_argument(
+        "rss",
+        nargs="*",
+        help="Paths to RSS XML files, or directories containing them",
+    )
+    parser.add_argument(
+        "--store",
+        help="SQLite database the exports are ingested into, so later imports "
+        "don't need to parse them again",
+    )
+    parser.add_argument(
+        "--only",
+        type=lambda v: v.split(","),
+        help="Comma separated slugs of the posts and pages to import",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="Only import posts and pages published on or after this date",
+    )
+    parser.add_argument(
+        "--html-backend",
+        default=WordpressToRst.DEFAULT_BACKEND,
+        choices=sorted(HtmlBackend.BACKENDS),
+        help="HTML tokenizer used to parse post content",
+    )
+    parser.add_argument(
+        "--compare-backends",
+        action="store_true",
+        help="Check that all HTML backends agree and benchmark them, writing nothing",
+    )
 
     args = parser.parse_args()
+    if not args.rss and not args.store:
+        parser.error("an export file is required unless --store is used")
 
     level = logging.DEBUG if args.verbose else logging.INFO
     logging.basicConfig()
     logging.getLogger().setLevel(level)
 
-    load_rss(args.rss)
+    if load_rss(
+        args.rss,
+        args.html_backend,
+        args.compare_backends,
+        args.store,
+        args.only,
+        args.since,
+    ):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
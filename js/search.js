@@ -0,0 +1,130 @@
+// Client for the static search index built by rstblog-search.
+//
+// Only the meta file and the shards holding the query's terms are fetched, so
+// the download size is bounded by the number of terms rather than the size of
+// the blog. Quoted queries match the terms as a phrase using the positional
+// postings.
+//
+// The index location is read from the data-index attribute of the script tag,
+// which rstblog-static sets from the output of rstblog-search. The form with
+// the id "search" is enabled once the script has loaded and lists its results
+// in the element with the id "search-results".
+(function () {
+    const script = document.currentScript;
+    const base = (script && script.dataset.index) || "/search";
+    const shards = new Map();
+    let meta = null;
+
+    // Must match rstblog_content.search.fnv1a
+    function fnv1a(term) {
+        let h = 0x811c9dc5;
+        for (const b of new TextEncoder().encode(term)) {
+            h = Math.imul(h ^ b, 0x01000193) >>> 0;
+        }
+        return h;
+    }
+
+    function tokenize(text) {
+        return (text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || []);
+    }
+
+    async function fetchJson(path) {
+        const r = await fetch(`${base}/${path}`);
+        if (!r.ok) {
+            throw new Error(`Unable to load ${path}: ${r.status}`);
+        }
+        return r.json();
+    }
+
+    async function postings(field, term) {
+        const name = `${field}-${fnv1a(term) % meta.shards}.json`;
+        if (!shards.has(name)) {
+            shards.set(name, fetchJson(name));
+        }
+        const result = new Map();
+        for (const [doc, ...deltas] of (await shards.get(name))[term] || []) {
+            let position = 0;
+            result.set(doc, deltas.map((d) => (position += d)));
+        }
+        return result;
+    }
+
+    function isPhrase(positions) {
+        return positions[0].some((start) =>
+            positions.every((p, i) => p.includes(start + i)));
+    }
+
+    async function search(query, field = "text") {
+        meta = meta || await fetchJson("meta.json");
+        const terms = tokenize(query);
+        if (!terms.length) {
+            return [];
+        }
+        const phrase = /^\s*".*"\s*$/.test(query);
+        const lists = await Promise.all(terms.map((t) => postings(field, t)));
+        const results = [];
+        for (const [doc] of lists[0]) {
+            const positions = lists.map((l) => l.get(doc));
+            if (positions.some((p) => !p) || (phrase && !isPhrase(positions))) {
+                continue;
+            }
+            const score = positions.reduce((n, p) => n + p.length, 0);
+            results.push({ ...meta.docs[doc], score });
+        }
+        return results.sort((a, b) => b.score - a.score);
+    }
+
+    function showResults(list, results) {
+        list.replaceChildren(...results.map((r) => {
+            const item = document.createElement("li");
+            const link = document.createElement("a");
+            link.href = `/${r.url}`;
+            link.textContent = r.title || r.url;
+            item.append(link);
+            if (r.date) {
+                const date = document.createElement("small");
+                date.className = "text-body-secondary ms-1";
+                date.textContent = r.date;
+                item.append(date);
+            }
+            return item;
+        }));
+        if (!results.length) {
+            const item = document.createElement("li");
+            item.textContent = "No results";
+            list.append(item);
+        }
+        list.hidden = false;
+    }
+
+    function bind() {
+        const form = document.getElementById("search");
+        const list = document.getElementById("search-results");
+        if (!form || !list) {
+            return;
+        }
+        form.addEventListener("submit", async (event) => {
+            event.preventDefault();
+            const query = form.elements.q.value;
+            if (!query.trim()) {
+                list.hidden = true;
+                return;
+            }
+            try {
+                showResults(list, await search(query));
+            } catch (e) {
+                list.textContent = "Search is unavailable";
+                list.hidden = false;
+                console.error(e);
+            }
+        });
+        form.hidden = false;
+    }
+
+    window.rstblogSearch = search;
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", bind);
+    } else {
+        bind();
+    }
+})();
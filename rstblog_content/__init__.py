@@ -27,6 +27,12 @@ def test():
         raise Exception(
             "Ensure that a branch is properly checked out befor running this script"
         )
+    # rstblog includes the pre-rendered previews as they are, so bring them up
+    # to date with the posts before it renders the index pages
+    from .preview import build as build_previews
+
+    print("Rendering the previews of posts which changed")
+    build_previews()
     url = f"http://localhost:{args.port}/{args.app_path}"
     print(
         f"Attempting to refresh local rstblog running at {url} with latest commit on {branch}"
@@ -0,0 +1,183 @@
+"""
+Analyzes the static assets (images, attachments) referenced by the content and
+enforces the size budgets configured in [tool.rstblog.budget]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import pathlib
+import sys
+
+from .config import load_config, content_dirs
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+KIB = 1024
+
+# Budgets used when pyproject.toml doesn't override them, all in KiB
+DEFAULT_BUDGET = {
+    "image": 2048,
+    "page": 8192,
+    "total": 40960,
+}
+
+
+def _rel(path):
+    return os.path.relpath(path)
+
+
+class PageWeight:
+    """
+    The weight of a single document along with the files it references
+    """
+
+    def __init__(self, document, files, missing):
+        self.document = document
+        self.files = files
+        self.missing = missing
+
+    @property
+    def path(self):
+        return self.document.path
+
+    @property
+    def size(self):
+        return self.document.path.stat().st_size + sum(self.files.values())
+
+
+def weigh(path):
+    """
+    Resolves every image and figure in the document at the passed path,
+    returning its PageWeight
+    """
+    document = Document.load(path)
+    files = {}
+    missing = []
+    for d in document.images:
+        for target in (d.argument, d.options.get("target", None)):
+            resolved = document.resolve(target)
+            if resolved is None:
+                continue
+            if resolved.is_file():
+                files[resolved] = resolved.stat().st_size
+            elif target == d.argument:
+                missing.append((d.line, target))
+    return PageWeight(document, files, missing)
+
+
+class Report:
+    def __init__(self, pages, assets, budget):
+        self.pages = pages
+        self.assets = assets
+        self.budget = budget
+
+    @property
+    def referenced(self):
+        return set(f for p in self.pages for f in p.files)
+
+    @property
+    def unreferenced(self):
+        return sorted(self.assets.keys() - self.referenced)
+
+    @property
+    def oversized(self):
+        limit = self.budget["image"] * KIB
+        return sorted(
+            ((f, s) for f, s in self.assets.items() if s > limit),
+            key=lambda i: -i[1],
+        )
+
+    @property
+    def overweight(self):
+        limit = self.budget["page"] * KIB
+        return [p for p in self.pages if p.size > limit]
+
+    @property
+    def total(self):
+        return sum(self.assets.values()) + sum(
+            p.document.path.stat().st_size for p in self.pages
+        )
+
+    @property
+    def errors(self):
+        errors = []
+        for f, s in self.oversized:
+            errors.append(
+                f"{_rel(f)}: image is {s // KIB} KiB, "
+                f"budget is {self.budget['image']} KiB"
+            )
+        for p in self.overweight:
+            errors.append(
+                f"{p.path}: page weighs {p.size // KIB} KiB, "
+                f"budget is {self.budget['page']} KiB"
+            )
+        for p in self.pages:
+            for line, target in p.missing:
+                errors.append(f"{p.path}:{line}: missing image {target}")
+        if self.total > self.budget["total"] * KIB:
+            errors.append(
+                f"Content weighs {self.total // KIB} KiB, "
+                f"budget is {self.budget['total']} KiB"
+            )
+        return errors
+
+
+def analyze(root=".", config=None, jobs=None):
+    """
+    Weighs every document and asset in the content tree
+    """
+    root = pathlib.Path(root)
+    config = config if config is not None else load_config(root)
+    budget = dict(DEFAULT_BUDGET, **config.get("budget", {}))
+    dirs = content_dirs(config, root)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pages = list(pool.map(weigh, find_documents(dirs)))
+    assets = dict(
+        (f.resolve(), f.stat().st_size)
+        for d in dirs
+        for f in d.rglob("*")
+        if f.is_file() and f.suffix != ".rst"
+    )
+    return Report(pages, assets, budget)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+    parser.add_argument(
+        "--top", default=10, type=int, help="Number of heaviest pages to list"
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Treat unreferenced files as budget violations",
+    )
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    report = analyze(args.root, jobs=args.jobs)
+    pages = sorted(report.pages, key=lambda p: -p.size)
+    print(f"{len(report.pages)} pages, {len(report.assets)} assets, ", end="")
+    print(f"{report.total // KIB} KiB total")
+    print("Heaviest pages:")
+    for p in pages[: args.top]:
+        print(f"  {p.size // KIB:>8} KiB  {p.path}")
+    unreferenced = report.unreferenced
+    for f in unreferenced:
+        _log.warning(f"{_rel(f)}: not referenced by any document")
+    errors = report.errors
+    if args.strict:
+        errors += [f"{_rel(f)}: not referenced by any document" for f in unreferenced]
+    for e in errors:
+        _log.error(e)
+    if errors:
+        sys.exit(1)
@@ -0,0 +1,104 @@
+"""
+Runs the build stages in the order they depend on each other. Run it before
+rstblog renders the site, to generate the files and templates it uses, and
+again with --rendered once it has, to process the rendered pages:
+
+1. rstblog-icons, rstblog-images and rstblog-prunecss write the icon
+   stylesheet, the image variants and the pruned stylesheets
+2. rstblog-static hashes the stylesheets and scripts, which must all exist by
+   then, and links them from static.j2
+3. rstblog-search, rstblog-feeds, rstblog-preview and rstblog-sidebar write
+   the search index, feeds and pre-rendered templates
+4. (--rendered) rstblog-postprocess rewrites the rendered pages, serving the
+   images through the variants from step 1
+5. (--rendered) rstblog-manifest hashes every served file, which is only final
+   once the pages have been processed
+
+css/pygments.css is written by rstblog itself, so on a fresh checkout the site
+must be rendered once before rstblog-static can run. The stages which check
+the content (rstblog-validate, rstblog-linkcheck and rstblog-assets) aren't
+part of the build and can be run at any time.
+"""
+
+import argparse
+import logging
+import pathlib
+import sys
+
+from . import (
+    feed,
+    icons,
+    images,
+    manifest,
+    postprocess,
+    preview,
+    prune,
+    search,
+    sidebar,
+    static,
+)
+from .config import load_config
+
+_log = logging.getLogger(__name__)
+
+
+def build(root=".", config=None, jobs=None, site=None):
+    """
+    Runs the stages which generate the files rstblog renders the site with,
+    returning False without running any if one of their inputs is missing
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    pygments = config.get("pygments", {}).get("csspath")
+    if pygments is not None and not (root / pygments).is_file():
+        _log.error(
+            f"{pygments} is written by rstblog, which must render the site once "
+            "before rstblog-static can link it"
+        )
+        return False
+    icons.build(root, config)
+    images.build(root, config, jobs=jobs)
+    prune.build(root, config, jobs=jobs, site=site)
+    static.build(root, config)
+    search.build(root, config)
+    feed.build(root, config)
+    preview.build(root, config, jobs=jobs)
+    sidebar.build(root, config, site=site)
+    return True
+
+
+def build_rendered(root=".", config=None, jobs=None, site=None):
+    """
+    Runs the stages which process the site rendered by rstblog, returning the
+    changes since the previous manifest
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    postprocess.build(root, config, site=site, jobs=jobs)
+    return manifest.build(root, config, site=site)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+    parser.add_argument("--site", help="Directory containing the rendered site")
+    parser.add_argument(
+        "--rendered",
+        action="store_true",
+        help="Process the site rendered by rstblog rather than generating its inputs",
+    )
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    if args.rendered:
+        build_rendered(args.root, jobs=args.jobs, site=args.site)
+    elif not build(args.root, jobs=args.jobs, site=args.site):
+        sys.exit(1)
@@ -0,0 +1,86 @@
+"""
+Content-addressed caching shared by the build stages
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+
+DEFAULT_CACHE_DIR = "./.rstblog-cache"
+
+
+def cache_dir(config, root="."):
+    """
+    Returns the directory build stages should keep their caches in, creating
+    it if needed
+    """
+    relative = config.get("paths", {}).get("cache", DEFAULT_CACHE_DIR)
+    path = pathlib.Path(root) / relative
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 16):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def text_hash(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8") if isinstance(p, str) else p)
+        # Separate the parts so ("ab", "c") and ("a", "bc") differ
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def write_atomic(path, data):
+    """
+    Writes the passed str or bytes to a sibling temporary file and moves it
+    into place so that readers never see a partial file
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    binary = isinstance(data, bytes)
+    with open(tmp, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class JsonCache:
+    """
+    A dict persisted as JSON. Entries which aren't touched with get() or put()
+    between load and save are dropped on save so the cache doesn't grow without
+    bound as content is removed.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+        self._used = set()
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self._used.add(key)
+            return self._entries[key]
+        return default
+
+    def put(self, key, value):
+        self._used.add(key)
+        self._entries[key] = value
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def save(self):
+        entries = dict((k, v) for k, v in self._entries.items() if k in self._used)
+        write_atomic(self.path, json.dumps(entries, indent=1, sort_keys=True))
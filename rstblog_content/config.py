@@ -0,0 +1,36 @@
+import pathlib
+import tomllib
+
+
+def load_config(root="."):
+    """
+    Loads the [tool.rstblog] table from the pyproject.toml at the root of the
+    content repository
+    """
+    root = pathlib.Path(root)
+    with open(root / "pyproject.toml", "rb") as f:
+        pyproject = tomllib.load(f)
+    return pyproject.get("tool", {}).get("rstblog", {})
+
+
+def content_dirs(config, root="."):
+    """
+    Returns the directories which contain ReST documents (posts and pages)
+    """
+    root = pathlib.Path(root)
+    paths = config.get("paths", {})
+    dirs = [root / paths[k] for k in ("posts", "pages") if k in paths]
+    return [d for d in dirs if d.is_dir()]
+
+
+def site_dir(config, root=".", site=None):
+    """
+    Returns the directory rstblog renders the pages into, or None if the site
+    isn't built locally. An explicitly passed directory takes precedence over
+    [tool.rstblog.paths] site.
+    """
+    site = site if site is not None else config.get("paths", {}).get("site")
+    if site is None:
+        return None
+    site = pathlib.Path(root) / site
+    return site if site.is_dir() else None
@@ -0,0 +1,192 @@
+"""
+Lightweight scanning of the ReST documents in this repository.
+
+This doesn't attempt to be a ReST parser. It only understands enough of the
+directive syntax to find the things the build tooling cares about (settings,
+images, code blocks) without paying for a full docutils parse.
+"""
+
+import pathlib
+import re
+
+DIRECTIVE_RE = re.compile(r"^(\s*)\.\. ([\w-]+)::[ \t]*(.*)$")
+OPTION_RE = re.compile(r"^\s+:([\w-]+):[ \t]*(.*)$")
+
+IMAGE_DIRECTIVES = ("image", "figure")
+
+
+class Directive:
+    def __init__(self, name, argument, line, indent):
+        self.name = name
+        self.argument = argument
+        self.line = line
+        self.indent = indent
+        self.options = {}
+        self.body = []
+        # Line number of the first body line (1-based), if any
+        self.body_line = None
+        # Last line of the directive and its options, and last line of the
+        # whole directive including its body
+        self.header_end = line
+        self.end = line
+
+    @property
+    def body_text(self):
+        """
+        Body of the directive with its common indentation removed
+        """
+        lines = list(self.body)
+        while lines and not lines[-1].strip():
+            lines.pop()
+        margin = min((len(l) - len(l.lstrip()) for l in lines if l.strip()), default=0)
+        return "\n".join(l[margin:] for l in lines)
+
+    def __repr__(self):
+        return f"<Directive {self.name} {self.argument!r} at line {self.line}>"
+
+
+def scan_directives(text):
+    """
+    Finds every explicit markup directive in the ReST text, gathering its
+    options and indented body
+    """
+    lines = text.splitlines()
+    directives = []
+    i = 0
+    while i < len(lines):
+        m = DIRECTIVE_RE.match(lines[i])
+        if not m:
+            i += 1
+            continue
+        d = Directive(m.group(2), m.group(3).strip(), i + 1, len(m.group(1)))
+        i += 1
+        # Options immediately follow the directive line
+        while i < len(lines) and (o := OPTION_RE.match(lines[i])):
+            if len(lines[i]) - len(lines[i].lstrip()) <= d.indent:
+                break
+            d.options[o.group(1)] = o.group(2).strip()
+            d.header_end = i + 1
+            i += 1
+        # The body is everything indented deeper than the directive
+        while i < len(lines):
+            line = lines[i]
+            if line.strip() and len(line) - len(line.lstrip()) <= d.indent:
+                break
+            if line.strip() and d.body_line is None:
+                d.body_line = i + 1
+            if d.body_line is not None:
+                d.body.append(line)
+            if line.strip():
+                d.end = i + 1
+            i += 1
+        d.end = max(d.end, d.header_end)
+        directives.append(d)
+        # Nested directives (e.g. an image within a note) are found by
+        # rescanning the body
+        if d.body_line is not None and d.name not in ("code-block",):
+            for n in scan_directives("\n".join(d.body)):
+                n.line += d.body_line - 1
+                n.header_end += d.body_line - 1
+                n.end += d.body_line - 1
+                if n.body_line is not None:
+                    n.body_line += d.body_line - 1
+                directives.append(n)
+    return directives
+
+
+class Document:
+    """
+    A ReST source file along with the directives found within it
+    """
+
+    def __init__(self, path, text):
+        self.path = pathlib.Path(path)
+        self.text = text
+        self.directives = scan_directives(text)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(path, f.read())
+
+    @property
+    def settings(self):
+        """
+        Options of the rstblog-settings directive, or an empty dict if the
+        document doesn't have one
+        """
+        for d in self.directives:
+            if d.name == "rstblog-settings":
+                return d.options
+        return {}
+
+    @property
+    def is_post(self):
+        return bool(self.settings)
+
+    @property
+    def title(self):
+        return self.settings.get("title", "")
+
+    @property
+    def date(self):
+        """
+        The publication date parsed from the settings, or None
+        """
+        from dateutil import parser
+
+        if not (date := self.settings.get("date", None)):
+            return None
+        return parser.parse(date)
+
+    @property
+    def tags(self):
+        tags = self.settings.get("tags", "")
+        return [t.strip() for t in tags.split(",") if t.strip()]
+
+    @property
+    def url(self):
+        """
+        The site-relative URL of the document, without slashes at either end
+        """
+        return self.settings.get("url", "").strip("/")
+
+    @property
+    def preview(self):
+        """
+        Source of the document preceding its rstblog-break, or None if there
+        is no break. The rstblog-settings directive is omitted.
+        """
+        breaks = [d for d in self.directives if d.name == "rstblog-break"]
+        if not breaks:
+            return None
+        lines = self.text.splitlines()[: breaks[0].line - 1]
+        for d in self.directives:
+            if d.name == "rstblog-settings":
+                lines[d.line - 1 : d.end] = [""] * (d.end - d.line + 1)
+        return "\n".join(lines).strip() + "\n"
+
+    @property
+    def images(self):
+        return [d for d in self.directives if d.name in IMAGE_DIRECTIVES]
+
+    @property
+    def code_blocks(self):
+        return [d for d in self.directives if d.name == "code-block"]
+
+    def resolve(self, target):
+        """
+        Resolves a local file reference relative to this document. Returns None
+        for references which are URLs rather than files.
+        """
+        if not target or re.match(r"^[a-z][a-z0-9+.-]*:", target, re.I):
+            return None
+        return (self.path.parent / target.split("#")[0]).resolve()
+
+
+def find_documents(dirs):
+    """
+    Finds all ReST sources beneath the passed directories
+    """
+    for d in dirs:
+        yield from sorted(pathlib.Path(d).rglob("*.rst"))
@@ -0,0 +1,227 @@
+"""
+Adds the intrinsic :width: and :height: of the image to every image and
+figure directive, so that browsers can lay pages out (and load images lazily)
+without the content shifting as the images arrive. Dimensions are read from
+the image headers alone and cached by file hash.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import pathlib
+import re
+import struct
+
+from .cache import JsonCache, cache_dir, file_hash, write_atomic
+from .config import load_config, content_dirs
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+# JPEG start of frame markers, which hold the dimensions
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+PIXELS_RE = re.compile(r"^(\d+)(px)?$")
+
+
+def _jpeg_orientation(exif):
+    """
+    Returns the EXIF orientation of a JPEG's APP1 segment, or 1 (upright)
+    """
+    if not exif.startswith(b"Exif\0\0"):
+        return 1
+    tiff = exif[6:]
+    endian = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if endian is None or len(tiff) < 8:
+        return 1
+    (ifd,) = struct.unpack_from(endian + "I", tiff, 4)
+    if ifd + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack_from(endian + "H", tiff, ifd)
+    for i in range(count):
+        offset = ifd + 2 + i * 12
+        if offset + 12 > len(tiff):
+            break
+        tag, _, _, value = struct.unpack_from(endian + "HHIH", tiff, offset)
+        if tag == 0x0112:
+            return value
+    return 1
+
+
+def _jpeg(f):
+    """
+    Reads the dimensions from the start of frame segment, returning None if
+    the file ends before it
+    """
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if byte != b"\xff":
+            return None
+        # Any number of 0xFF fill bytes may precede a marker
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            # Markers without a length
+            continue
+        if len(data := f.read(2)) < 2:
+            return None
+        (length,) = struct.unpack(">H", data)
+        if length < 2:
+            return None
+        if marker in SOF_MARKERS:
+            if len(data := f.read(5)) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", data)
+            # Browsers apply the EXIF orientation, which may swap the axes
+            return (height, width) if orientation >= 5 else (width, height)
+        if marker == 0xE1:
+            orientation = _jpeg_orientation(f.read(length - 2))
+        else:
+            f.seek(length - 2, 1)
+
+
+def probe(path):
+    """
+    Reads the (width, height) of an image from its header, returning None if
+    the format isn't recognized or the header is truncated
+    """
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head.startswith(b"\xff\xd8"):
+            return _jpeg(f)
+        # Each header is checked to be long enough to hold the dimensions
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24]) if len(head) >= 24 else None
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10]) if len(head) >= 10 else None
+        if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+            chunk = head[12:16]
+            if chunk == b"VP8 " and len(head) >= 30:
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L" and len(head) >= 25:
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X" and len(head) >= 30:
+                width = int.from_bytes(head[24:27], "little") + 1
+                height = int.from_bytes(head[27:30], "little") + 1
+                return width, height
+    return None
+
+
+def dimension_options(options, size):
+    """
+    Returns the options to add to an image directive with the passed options
+    so that it has both a width and height. An explicit pixel width is kept
+    and the height scaled to match. Nothing is added to images sized in other
+    units or which already have a height.
+    """
+    if size is None or "height" in options or "scale" in options:
+        return {}
+    width, height = size
+    if "width" not in options:
+        return {"width": str(width), "height": str(height)}
+    if (m := PIXELS_RE.match(options["width"].strip())) and width:
+        return {"height": str(round(height * int(m.group(1)) / width))}
+    return {}
+
+
+class DimensionCache:
+    """
+    Image dimensions keyed by the hash of the image file
+    """
+
+    def __init__(self, path):
+        self.cache = JsonCache(path)
+
+    def measure(self, paths, jobs=None):
+        """
+        Returns a dict of path to (width, height), or None for unrecognized
+        images, probing the images which aren't cached in parallel
+        """
+
+        def measure(path):
+            digest = file_hash(path)
+            if (size := self.cache.get(digest)) is None:
+                size = probe(path)
+                self.cache.put(digest, size and list(size))
+            return path, tuple(size) if size else None
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return dict(pool.map(measure, paths))
+
+    def save(self):
+        self.cache.save()
+
+
+def rewrite(document, sizes):
+    """
+    Returns the text of the document with dimensions added to its image and
+    figure directives, or None if nothing needed to change
+    """
+    lines = document.text.splitlines()
+    insertions = []
+    for d in document.images:
+        path = document.resolve(d.argument)
+        if not (add := dimension_options(d.options, sizes.get(path))):
+            continue
+        options = lines[d.line : d.header_end]
+        indent = len(options[0]) - len(options[0].lstrip()) if options else d.indent + 3
+        insertions.append(
+            (d.header_end, [f"{' ' * indent}:{k}: {v}" for k, v in add.items()])
+        )
+    if not insertions:
+        return None
+    # Insert from the end so that earlier line numbers stay valid
+    for line, new in sorted(insertions, reverse=True):
+        lines[line:line] = new
+    return "\n".join(lines) + ("\n" if document.text.endswith("\n") else "")
+
+
+def build(root=".", config=None, jobs=None):
+    """
+    Adds dimensions to the images of every document, returning the paths of
+    the documents which were rewritten
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    documents = [Document.load(p) for p in find_documents(content_dirs(config, root))]
+    images = set()
+    for document in documents:
+        for d in document.images:
+            if (path := document.resolve(d.argument)) and path.is_file():
+                images.add(path)
+    cache = DimensionCache(cache_dir(config, root) / "dimensions.json")
+    sizes = cache.measure(sorted(images), jobs)
+    cache.save()
+    for path, size in sizes.items():
+        if size is None:
+            _log.warning(f"{path.relative_to(root)}: unable to read dimensions")
+    rewritten = []
+    for document in documents:
+        if (text := rewrite(document, sizes)) is not None:
+            _log.info(f"Adding image dimensions to {document.path.relative_to(root)}")
+            write_atomic(document.path, text)
+            rewritten.append(document.path)
+    _log.info(f"Rewrote {len(rewritten)} of {len(documents)} documents")
+    return rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root, jobs=args.jobs)
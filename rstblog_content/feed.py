@@ -0,0 +1,182 @@
+"""
+Generates Atom and RSS feeds of the newest posts, plus an Atom feed for each
+tag. Feeds are only rewritten when the set of entries in them changes, and a
+strong ETag is recorded for each so the server can answer conditional requests
+cheaply.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import email.utils
+import json
+import logging
+import pathlib
+from xml.etree import ElementTree as ET
+
+from .cache import JsonCache, cache_dir, file_hash, text_hash, write_atomic
+from .config import load_config
+from .content import Document, find_documents
+from .search import extract
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "site_url": "https://kevincuzner.com",
+    "title": "Kevin Cuzner's Personal Blog",
+    "author": "Kevin Cuzner",
+    "entries": 20,
+    "output": "./feeds",
+}
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+
+
+class Entry:
+    def __init__(self, path):
+        document = Document.load(path)
+        self.hash = file_hash(path)
+        self.url = document.url
+        self.title = document.title
+        self.tags = document.tags
+        # Drafts without a :date: are left out of the feeds
+        date = document.date
+        self.date = date and date.replace(tzinfo=date.tzinfo or datetime.timezone.utc)
+        self.summary = self._summary(document)
+
+    @staticmethod
+    def _summary(document):
+        if (preview := document.preview) is not None:
+            text, _ = extract(Document(document.path, preview))
+            # extract() leads with the (empty) title of the preview
+            return text.strip()
+        # Without a break, use the first paragraph
+        text, _ = extract(document)
+        paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
+        return paragraphs[1] if len(paragraphs) > 1 else ""
+
+    @property
+    def key(self):
+        return text_hash(self.url, self.hash)
+
+
+def _link(settings, url):
+    return f"{settings['site_url'].rstrip('/')}/{url}"
+
+
+def render_atom(name, title, entries, settings):
+    ET.register_namespace("", ATOM_NS)
+
+    def sub(parent, tag, text=None, **attrs):
+        el = ET.SubElement(parent, f"{{{ATOM_NS}}}{tag}", attrs)
+        el.text = text
+        return el
+
+    feed = ET.Element(f"{{{ATOM_NS}}}feed")
+    sub(feed, "title", title)
+    sub(feed, "id", _link(settings, f"feeds/{name}"))
+    sub(feed, "link", href=_link(settings, f"feeds/{name}"), rel="self")
+    sub(feed, "link", href=_link(settings, ""))
+    # The feed is updated when its newest entry was, which keeps the output
+    # stable between builds that don't change the entries
+    updated = max((e.date for e in entries), default=None)
+    sub(feed, "updated", updated.isoformat() if updated else None)
+    author = sub(feed, "author")
+    sub(author, "name", settings["author"])
+    for e in entries:
+        entry = sub(feed, "entry")
+        sub(entry, "title", e.title)
+        sub(entry, "id", _link(settings, e.url))
+        sub(entry, "link", href=_link(settings, e.url))
+        sub(entry, "updated", e.date.isoformat())
+        sub(entry, "published", e.date.isoformat())
+        for t in e.tags:
+            sub(entry, "category", term=t)
+        sub(entry, "summary", e.summary)
+    return ET.tostring(feed, encoding="utf-8", xml_declaration=True)
+
+
+def render_rss(name, title, entries, settings):
+    rss = ET.Element("rss", version="2.0")
+    channel = ET.SubElement(rss, "channel")
+    ET.SubElement(channel, "title").text = title
+    ET.SubElement(channel, "link").text = _link(settings, "")
+    ET.SubElement(channel, "description").text = title
+    for e in entries:
+        item = ET.SubElement(channel, "item")
+        ET.SubElement(item, "title").text = e.title
+        ET.SubElement(item, "link").text = _link(settings, e.url)
+        ET.SubElement(item, "guid").text = _link(settings, e.url)
+        ET.SubElement(item, "pubDate").text = email.utils.format_datetime(e.date)
+        for t in e.tags:
+            ET.SubElement(item, "category").text = t
+        ET.SubElement(item, "description").text = e.summary
+    return ET.tostring(rss, encoding="utf-8", xml_declaration=True)
+
+
+def feeds(entries, settings):
+    """
+    Yields (file name, title, entries, renderer) for every feed of the site
+    """
+    newest = sorted(entries, key=lambda e: e.date, reverse=True)
+    top = newest[: settings["entries"]]
+    yield "atom.xml", settings["title"], top, render_atom
+    yield "rss.xml", settings["title"], top, render_rss
+    tags = sorted(set(t for e in entries for t in e.tags))
+    for tag in tags:
+        tagged = [e for e in newest if tag in e.tags][: settings["entries"]]
+        title = f"{settings['title']}: {tag}"
+        yield f"tags/{tag}.xml", title, tagged, render_atom
+
+
+def build(root=".", config=None):
+    """
+    Rewrites every feed whose entries changed since the last build, returning
+    a dict of feed file name to ETag
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("feeds", {}))
+    output = root / settings["output"]
+    posts = root / config.get("paths", {}).get("posts", "./posts")
+    with ThreadPoolExecutor() as pool:
+        entries = list(pool.map(Entry, find_documents([posts])))
+    entries = [e for e in entries if e.url and e.date]
+    cache = JsonCache(cache_dir(config, root) / "feeds.json")
+    settings_key = json.dumps(settings, sort_keys=True)
+    etags = {}
+    rendered = 0
+    for name, title, feed_entries, render in feeds(entries, settings):
+        key = text_hash(settings_key, title, *(e.key for e in feed_entries))
+        cached = cache.get(name)
+        path = output / name
+        if cached is None or cached["key"] != key or not path.is_file():
+            _log.info(f"Rendering {name}")
+            data = render(name, title, feed_entries, settings)
+            write_atomic(path, data)
+            cached = {"key": key, "etag": f'"{text_hash(data)[:32]}"'}
+            rendered += 1
+        cache.put(name, cached)
+        etags[name] = cached["etag"]
+    # Remove feeds of tags that no longer have posts
+    for f in output.glob("tags/*.xml"):
+        if f.relative_to(output).as_posix() not in etags:
+            f.unlink()
+    cache.save()
+    write_atomic(output / "etags.json", json.dumps(etags, indent=1, sort_keys=True))
+    _log.info(f"Rendered {rendered} of {len(etags)} feeds")
+    return etags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root)
@@ -0,0 +1,109 @@
+"""
+Builds a stylesheet containing only the Bootstrap Icons used by the
+templates, from the vendored SVG sprite, so that the site doesn't need the
+full icon font from a CDN. Each icon is drawn as a CSS mask of its inline SVG,
+so the existing <i class="bi bi-..."> markup keeps working.
+"""
+
+import argparse
+import logging
+import pathlib
+import re
+import urllib.parse
+from xml.etree import ElementTree as ET
+
+from .cache import JsonCache, cache_dir, file_hash, text_hash, write_atomic
+from .config import load_config
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "source": "./vendor/bootstrap-icons/bootstrap-icons.svg",
+    "output": "./css/icons.css",
+}
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+ICON_CLASS_RE = re.compile(r"\bbi-([a-z0-9]+(?:-[a-z0-9]+)*)")
+
+# Sized and aligned the same as the glyphs of the icon font
+BASE_RULE = (
+    '.bi::before,[class^="bi-"]::before,[class*=" bi-"]::before{'
+    'display:inline-block;content:"";width:1em;height:1em;vertical-align:-.125em;'
+    "background-color:currentColor;"
+    "-webkit-mask:no-repeat center/contain;mask:no-repeat center/contain}"
+)
+
+
+def used_icons(root):
+    """
+    Returns the names of the icons used by the templates
+    """
+    icons = set()
+    for template in sorted(pathlib.Path(root).glob("*.j2")):
+        icons.update(ICON_CLASS_RE.findall(template.read_text()))
+    return sorted(icons)
+
+
+def extract_icons(source, names):
+    """
+    Returns a dict of icon name to a standalone SVG document for each of the
+    named icons found in the sprite
+    """
+    ET.register_namespace("", SVG_NS)
+    symbols = dict(
+        (s.get("id"), s) for s in ET.parse(source).getroot() if s.get("id") in names
+    )
+    icons = {}
+    for name in names:
+        if (symbol := symbols.get(name)) is None:
+            _log.warning(f'Icon "{name}" is not in {source}')
+            continue
+        svg = ET.Element(f"{{{SVG_NS}}}svg", viewBox=symbol.get("viewBox"))
+        svg.extend(symbol)
+        icons[name] = ET.tostring(svg, encoding="unicode")
+    return icons
+
+
+def render(icons):
+    rules = ["/* Generated by rstblog-icons from Bootstrap Icons (MIT) */", BASE_RULE]
+    for name, svg in sorted(icons.items()):
+        url = f'url("data:image/svg+xml,{urllib.parse.quote(svg, safe=" =:/")}")'
+        rules.append(f".bi-{name}::before{{-webkit-mask-image:{url};mask-image:{url}}}")
+    return "\n".join(rules) + "\n"
+
+
+def build(root=".", config=None):
+    """
+    Rewrites the icon stylesheet if the icons in use or the vendored icon set
+    changed since the last build
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("icons", {}))
+    source, output = root / settings["source"], root / settings["output"]
+    names = used_icons(root)
+    key = text_hash(file_hash(source), *names)
+    cache = JsonCache(cache_dir(config, root) / "icons.json")
+    if cache.get("key") != key or not output.is_file():
+        icons = extract_icons(source, names)
+        write_atomic(output, render(icons))
+        _log.info(f"Wrote {len(icons)} icons to {output}: {', '.join(icons)}")
+    else:
+        _log.info(f"{output.name} is up to date")
+    cache.put("key", key)
+    cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root)
@@ -0,0 +1,301 @@
+"""
+Generates responsive variants (several widths and modern formats) of every
+image referenced by the content, along with a manifest of the variants of the
+image at each URL. rstblog-postprocess uses the manifest to serve the variants
+with <picture> and srcset markup in the rendered pages.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import html
+import json
+import logging
+import pathlib
+import posixpath
+import re
+import shutil
+import urllib.parse
+
+from .cache import file_hash, text_hash, write_atomic
+from .config import load_config, content_dirs
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "widths": [320, 640, 1024, 1600],
+    "formats": ["avif", "webp"],
+    "quality": 80,
+    "output": "./img",
+    "manifest": "./img/manifest.json",
+    # Displayed width of content images, by default the col-8 column of the
+    # Bootstrap container at each breakpoint. Images with a width attribute
+    # are displayed at most that wide instead.
+    "sizes": (
+        "(min-width: 1400px) 856px, (min-width: 1200px) 736px, "
+        "(min-width: 992px) 616px, (min-width: 768px) 456px, 100vw"
+    ),
+}
+
+# Bumped whenever generating the variants changes so that they are rebuilt
+VERSION = 2
+
+# Pillow format names, extensions and mime types for each output format
+FORMATS = {
+    "avif": ("AVIF", "avif", "image/avif"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "png": ("PNG", "png", "image/png"),
+}
+
+IMG_RE = re.compile(r"<img\b[^>]*>", re.I)
+ATTR_RE = re.compile(r"""([^\s=/>]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+PIXELS_RE = re.compile(r"^(\d+)(px)?$")
+
+
+def _open_image(path):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("Pillow must be installed to generate responsive images")
+    return Image.open(path)
+
+
+def _upright(image):
+    """
+    Applies the EXIF orientation to the pixels, since the variants are saved
+    without it. Browsers display the source rotated, so the variants must be.
+    """
+    from PIL import ImageOps
+
+    return ImageOps.exif_transpose(image)
+
+
+def _fallback_format(image):
+    """
+    The format served to browsers which support none of the modern formats
+    """
+    return "png" if image.format in ("PNG", "GIF") else "jpeg"
+
+
+def build_variants(source, key, output, url, settings):
+    """
+    Generates every variant of a single image. This runs in a worker process.
+    """
+    image = _open_image(source)
+    if getattr(image, "is_animated", False):
+        # Animations don't survive resizing into most formats, serve as-is
+        width, height = image.size
+        return {"width": width, "height": height, "key": key, "variants": []}
+    fallback = _fallback_format(image)
+    image = _upright(image)
+    width, height = image.size
+    entry = {"width": width, "height": height, "key": key, "variants": []}
+    # Never upscale, and only serve the full size if it's within the largest
+    # configured width
+    widths = [w for w in settings["widths"] if w < width]
+    if width <= max(settings["widths"]) or not widths:
+        widths.append(width)
+    formats = list(settings["formats"]) + [fallback]
+    stem = pathlib.Path(source).stem
+    out_dir = pathlib.Path(output) / key[:16]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for fmt in formats:
+        pil_format, ext, mime = FORMATS[fmt]
+        for w in widths:
+            name = f"{stem}-{w}.{ext}"
+            h = max(1, round(height * w / width))
+            resized = image if w == width else image.resize((w, h))
+            if pil_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+            resized.save(out_dir / name, pil_format, quality=settings["quality"])
+            entry["variants"].append(
+                {
+                    "type": mime,
+                    "width": w,
+                    "file": f"{key[:16]}/{name}",
+                    "url": f"{url}/{key[:16]}/{name}",
+                }
+            )
+    return entry
+
+
+def srcsets(entry):
+    """
+    Groups the variants of a manifest entry into one srcset per mime type
+    """
+    sets = {}
+    for v in entry["variants"]:
+        sets.setdefault(v["type"], []).append(f"{v['url']} {v['width']}w")
+    return dict((t, ", ".join(s)) for t, s in sets.items())
+
+
+def image_url(document, target):
+    """
+    The URL an image referenced by a document is served at
+    """
+    target = target.split("#")[0]
+    if target.startswith("/"):
+        return posixpath.normpath(target)
+    return posixpath.normpath(f"/{document.url}/{target}")
+
+
+def referenced_images(dirs):
+    """
+    Finds every image file used as the argument of an image or figure,
+    returning a dict of each file to the URLs it is referenced by
+    """
+    images = {}
+    for path in find_documents(dirs):
+        document = Document.load(path)
+        for d in document.images:
+            resolved = document.resolve(d.argument)
+            if resolved is not None and resolved.is_file():
+                urls = images.setdefault(resolved, set())
+                urls.add(image_url(document, d.argument))
+    return dict(sorted(images.items()))
+
+
+def _attributes(tag):
+    return dict(
+        (m.group(1).lower(), html.unescape((m.group(2) or "").strip("\"'")))
+        for m in ATTR_RE.finditer(tag[len("<img") :].rstrip(">/"))
+    )
+
+
+def picture(tag, entry, sizes):
+    """
+    Returns the <picture> markup serving the variants of an image in place of
+    its <img> tag. The tag keeps its src for browsers without srcset.
+    """
+    attributes = _attributes(tag)
+    if m := PIXELS_RE.match(attributes.get("width", "").strip()):
+        sizes = f"{m.group(1)}px"
+    sets = srcsets(entry)
+    # The fallback format is always generated last
+    *modern, fallback = sets
+    added = {"srcset": sets[fallback], "sizes": sizes}
+    if not {"width", "height", "style"} & attributes.keys():
+        added.update(width=str(entry["width"]), height=str(entry["height"]))
+    end = " />" if tag.endswith("/>") else ">"
+    img = tag[: -len(end.strip())].rstrip() + "".join(
+        f' {k}="{html.escape(v)}"' for k, v in added.items()
+    )
+    sources = "".join(
+        f'<source type="{t}" srcset="{html.escape(sets[t])}" '
+        f'sizes="{html.escape(sizes)}" />'
+        for t in modern
+    )
+    return f"<picture>{sources}{img}{end}</picture>"
+
+
+def responsive(text, locate, sizes):
+    """
+    Replaces the <img> tags in a rendered page with <picture> markup for the
+    images which have variants. locate maps the src of an image to its
+    manifest entry, or None.
+    """
+
+    def replace(m):
+        tag = m.group(0)
+        attributes = _attributes(tag)
+        if "srcset" in attributes or "src" not in attributes:
+            return tag
+        entry = locate(attributes["src"])
+        if entry is None or not entry["variants"]:
+            return tag
+        return picture(tag, entry, sizes)
+
+    return IMG_RE.sub(replace, text)
+
+
+def locator(manifest, bases):
+    """
+    Returns a function which finds the manifest entry of an image by its src
+    on a page, trying relative sources against each of the page's possible
+    base URLs
+    """
+    by_url = dict((u, e) for e in manifest.values() for u in e.get("urls", []))
+
+    def locate(src):
+        for base in bases:
+            path = urllib.parse.urlparse(urllib.parse.urljoin(base, src)).path
+            if (entry := by_url.get(posixpath.normpath(path))) is not None:
+                return entry
+        return None
+
+    return locate
+
+
+def build(root=".", config=None, jobs=None):
+    """
+    Builds the variants of every referenced image, reusing any whose source
+    and settings haven't changed since the last build. Returns the manifest.
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("images", {}))
+    output = root / settings["output"]
+    manifest_path = root / settings["manifest"]
+    url = "/" + pathlib.PurePosixPath(settings["output"]).name
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    except FileNotFoundError:
+        previous = {}
+    images = referenced_images(content_dirs(config, root))
+    sources = list(images)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        digests = list(pool.map(file_hash, sources))
+    # sizes only affects the markup, not the variants
+    settings_key = json.dumps(
+        dict((k, v) for k, v in settings.items() if k != "sizes"), sort_keys=True
+    )
+    manifest = {}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for source, digest in zip(sources, digests):
+            name = source.relative_to(root).as_posix()
+            key = text_hash(digest, settings_key, str(VERSION))
+            cached = previous.get(name, None)
+            if (
+                cached is not None
+                and cached["key"] == key
+                and all((output / v["file"]).is_file() for v in cached["variants"])
+            ):
+                manifest[name] = cached
+                continue
+            _log.info(f"Generating variants of {name}")
+            pending[name] = pool.submit(
+                build_variants, source, key, output, url, settings
+            )
+        for name, future in pending.items():
+            manifest[name] = future.result()
+    for source in sources:
+        entry = manifest[source.relative_to(root).as_posix()]
+        entry["srcset"] = srcsets(entry)
+        entry["urls"] = sorted(images[source])
+    # Remove variants of images which have changed or are no longer used
+    keys = set(e["key"][:16] for e in manifest.values())
+    for d in output.iterdir() if output.is_dir() else []:
+        if d.is_dir() and d.name not in keys:
+            _log.debug(f"Removing stale variants in {d}")
+            shutil.rmtree(d)
+    write_atomic(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+    _log.info(f"{len(pending)} of {len(manifest)} images regenerated")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root, jobs=args.jobs)
@@ -0,0 +1,215 @@
+"""
+Checks the links in every document: internal links against the :url: of every
+post and page, local references against the files next to the document, and
+(optionally) external links over the network with results cached for a TTL
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import pathlib
+import re
+import sys
+import time
+import urllib.parse
+
+from .cache import JsonCache, cache_dir
+from .config import load_config, content_dirs
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    # Hosts which served this blog in the past. Links to them are checked as
+    # internal links.
+    "internal_hosts": ["kevincuzner.com", "www.kevincuzner.com", "cuznersoft.com"],
+    "ttl_days": 7,
+    "timeout": 10,
+}
+
+# `text <ref>`_ and `text <ref>`__, possibly spanning lines
+EMBEDDED_RE = re.compile(r"`[^`]*?<([^<>`]+)>`__?")
+# .. _name: ref
+TARGET_RE = re.compile(r"^\s*\.\. _([^:]+):[ \t]*(\S*)\s*$", re.M)
+SECTION_RE = re.compile(r"^([=\-~^\"'`#*+])\1{2,}\s*$")
+
+
+def make_id(text):
+    """
+    Normalizes a target name or section title the way docutils does
+    """
+    return "-".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+class Link:
+    def __init__(self, document, line, ref, kind):
+        self.document = document
+        self.line = line
+        self.ref = ref
+        self.kind = kind
+
+    @property
+    def location(self):
+        return f"{self.document.path}:{self.line}"
+
+
+def _line_of(text, offset):
+    return text.count("\n", 0, offset) + 1
+
+
+def extract_links(path):
+    """
+    Finds every link in a document, along with the targets it defines
+    """
+    document = Document.load(path)
+    text = document.text
+    links = []
+    for m in EMBEDDED_RE.finditer(text):
+        links.append(Link(document, _line_of(text, m.start(1)), m.group(1), "link"))
+    targets = set()
+    for m in TARGET_RE.finditer(text):
+        targets.add(make_id(m.group(1)))
+        if m.group(2):
+            line = _line_of(text, m.start(2))
+            links.append(Link(document, line, m.group(2), "target"))
+    lines = text.splitlines()
+    for i, line in enumerate(lines[1:], start=1):
+        if SECTION_RE.match(line) and lines[i - 1].strip():
+            targets.add(make_id(lines[i - 1]))
+    for d in document.images:
+        links.append(Link(document, d.line, d.argument, d.name))
+        if "target" in d.options:
+            links.append(Link(document, d.line, d.options["target"], ":target:"))
+    return document, targets, links
+
+
+class Checker:
+    def __init__(self, urls, settings):
+        self.urls = urls
+        self.settings = settings
+
+    def is_external(self, link):
+        scheme, netloc, _, _, _, _ = urllib.parse.urlparse(link.ref)
+        return (
+            scheme in ("http", "https")
+            and netloc not in self.settings["internal_hosts"]
+        )
+
+    def check_internal(self, link, targets):
+        """
+        Returns the reason the link is broken, or None if it is fine
+        """
+        scheme, netloc, path, _, query, fragment = urllib.parse.urlparse(link.ref)
+        if scheme:
+            if scheme not in ("http", "https") or self.is_external(link):
+                return None
+            if "/wp-content/" in path:
+                return "points at an old WordPress attachment"
+            if re.search(r"(^|&)p=\d+", query):
+                return "points at an old WordPress permalink"
+            return self._check_url(path)
+        if not path:
+            return None if make_id(fragment) in targets else "unknown anchor"
+        if make_id(path) in targets:
+            # Local anchor, as produced by LinkTag.to_rst for "#name" links
+            return None
+        if (resolved := link.document.resolve(path)) and resolved.exists():
+            return None
+        if link.kind != "link":
+            return "file not found"
+        return self._check_url(path)
+
+    def _check_url(self, path):
+        url = urllib.parse.unquote(path).strip("/")
+        if not url or url in self.urls:
+            return None
+        return "no document with this :url:"
+
+
+def check_external(urls, cache, settings):
+    """
+    Requests every external URL whose cached result has expired, returning a
+    dict of URL to the reason it is broken
+    """
+    import requests
+
+    now = time.time()
+    ttl = settings["ttl_days"] * 24 * 60 * 60
+
+    def check(url):
+        try:
+            r = requests.head(url, allow_redirects=True, timeout=settings["timeout"])
+            if r.status_code in (403, 405):
+                # Plenty of servers refuse HEAD, try again with a real request
+                r = requests.get(
+                    url, allow_redirects=True, timeout=settings["timeout"], stream=True
+                )
+            return None if r.ok else f"HTTP {r.status_code}"
+        except requests.RequestException as e:
+            return type(e).__name__
+
+    stale = [u for u in urls if (c := cache.get(u)) is None or now - c["checked"] > ttl]
+    _log.info(f"Checking {len(stale)} of {len(urls)} external links")
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        for url, error in zip(stale, pool.map(check, stale)):
+            cache.put(url, {"checked": now, "error": error})
+    return dict((u, cache.get(u)["error"]) for u in urls if cache.get(u)["error"])
+
+
+def check(root=".", config=None, external=False):
+    """
+    Checks all links, returning a list of (Link, reason) for every broken one.
+    In offline mode, external links are only reported if a previous online
+    check found them to be broken.
+    """
+    root = pathlib.Path(root)
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("links", {}))
+    with ThreadPoolExecutor() as pool:
+        results = list(
+            pool.map(extract_links, find_documents(content_dirs(config, root)))
+        )
+    checker = Checker(set(d.url for d, _, _ in results), settings)
+    broken = []
+    external_links = []
+    for _, targets, links in results:
+        for link in links:
+            if reason := checker.check_internal(link, targets):
+                broken.append((link, reason))
+            elif checker.is_external(link):
+                external_links.append(link)
+    cache = JsonCache(cache_dir(config, root) / "links.json")
+    urls = sorted(set(l.ref for l in external_links))
+    if external:
+        errors = check_external(urls, cache, settings)
+    else:
+        errors = dict(
+            (u, c["error"]) for u in urls if (c := cache.get(u)) and c["error"]
+        )
+    cache.save()
+    broken.extend((l, errors[l.ref]) for l in external_links if l.ref in errors)
+    return broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument(
+        "--external",
+        action="store_true",
+        help="Check external links over the network (results are cached)",
+    )
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    broken = check(args.root, external=args.external)
+    broken.sort(key=lambda b: (str(b[0].document.path), b[0].line))
+    for link, reason in broken:
+        _log.error(f"{link.location}: {link.ref}: {reason}")
+    if broken:
+        sys.exit(1)
@@ -0,0 +1,134 @@
+"""
+Records a content hash and strong ETag for every file the site serves, and
+lists which of them were added, changed or removed since the previous build so
+that deploys and cache purges only need to touch those files
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import pathlib
+
+from .cache import JsonCache, cache_dir, file_hash, write_atomic
+from .config import load_config, content_dirs, site_dir
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "output": "./manifest.json",
+    "changes": "./changes.json",
+}
+
+ETAG_LENGTH = 32
+
+
+def served_files(root, config, site=None):
+    """
+    Yields (URL, path) for every file served by the site: the static
+    directories, the files accompanying each document and, if the site is
+    rendered locally, the rendered pages
+    """
+    for d in config.get("paths", {}).get("static", []):
+        d = root / d
+        for f in sorted(d.rglob("*")) if d.is_dir() else []:
+            if f.is_file() and not f.name.startswith("."):
+                yield f"/{d.name}/{f.relative_to(d).as_posix()}", f
+    for path in find_documents(content_dirs(config, root)):
+        document = Document.load(path)
+        if not document.url:
+            continue
+        for f in sorted(path.parent.iterdir()):
+            if f.is_file() and f.suffix != ".rst":
+                yield f"/{document.url}/{f.name}", f
+    if site is not None:
+        for f in sorted(site.rglob("*")):
+            if f.is_file() and not f.name.startswith("."):
+                yield f"/{f.relative_to(site).as_posix()}", f
+
+
+def diff(previous, current):
+    """
+    Compares two manifests, returning the URLs which were added, changed and
+    removed
+    """
+    return {
+        "added": sorted(current.keys() - previous.keys()),
+        "changed": sorted(
+            u
+            for u in current.keys() & previous.keys()
+            if current[u]["hash"] != previous[u]["hash"]
+        ),
+        "removed": sorted(previous.keys() - current.keys()),
+    }
+
+
+def build(root=".", config=None, site=None):
+    """
+    Hashes every served file, rehashing only those whose size or mtime
+    changed, and writes the manifest along with the changes since the last
+    one. Returns the changes.
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("manifest", {}))
+    if (site := site_dir(config, root, site)) is None:
+        _log.warning("The site isn't rendered locally, its pages aren't included")
+    hashes = JsonCache(cache_dir(config, root) / "hashes.json")
+
+    def hash_file(item):
+        url, path = item
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        name = path.as_posix()
+        if (cached := hashes.get(name)) is None or cached["stamp"] != stamp:
+            cached = {"stamp": stamp, "hash": file_hash(path)}
+        hashes.put(name, cached)
+        entry = {
+            "hash": cached["hash"],
+            "etag": f'"{cached["hash"][:ETAG_LENGTH]}"',
+            "size": stat.st_size,
+        }
+        return url, entry
+
+    files = dict(served_files(root, config, site))
+    with ThreadPoolExecutor() as pool:
+        manifest = dict(pool.map(hash_file, sorted(files.items())))
+    hashes.save()
+    output = root / settings["output"]
+    try:
+        with open(output) as f:
+            previous = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        previous = {}
+    changes = diff(previous, manifest)
+    write_atomic(output, json.dumps(manifest, indent=1, sort_keys=True))
+    write_atomic(root / settings["changes"], json.dumps(changes, indent=1))
+    summary = ", ".join(f"{len(v)} {k}" for k, v in changes.items())
+    _log.info(f"{len(manifest)} files: {summary}")
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("--site", help="Directory containing the rendered site")
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Print the URLs which changed, prefixed with A, M or D",
+    )
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    changes = build(args.root, site=args.site)
+    if args.list:
+        for prefix, kind in (("A", "added"), ("M", "changed"), ("D", "removed")):
+            for url in changes[kind]:
+                print(f"{prefix} {url}")
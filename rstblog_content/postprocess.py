@@ -0,0 +1,374 @@
+"""
+Post-processes the HTML pages rendered by rstblog: the CSS needed for the
+layout at the top of each page is inlined and the stylesheets are loaded
+without blocking rendering, the code highlighting stylesheet is dropped from
+pages without code, images with responsive variants from rstblog-images are
+served through <picture> markup, and the HTML is minified. Pages are processed
+in place, in parallel. The page rstblog rendered is kept in the cache by its
+hash, so that pages are processed again from it, never from their processed
+output, when the settings or stylesheets change.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import json
+import logging
+import pathlib
+import re
+
+from .cache import JsonCache, cache_dir, file_hash, text_hash, write_atomic
+from .config import load_config, site_dir
+from .images import DEFAULT_SETTINGS as IMAGE_SETTINGS, locator, responsive
+from .prune import html_classes, prune, split_rules, strip_comments
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    # Directory rstblog renders the pages into, if not [tool.rstblog.paths] site
+    "site": None,
+    # Classes and elements used within this many characters of the start of
+    # <body> are considered above the fold, and the CSS they need is inlined
+    "fold": 4096,
+    # Stylesheets whose name starts with this are only needed by pages with
+    # highlighted code
+    "code_stylesheet": "pygments",
+}
+
+# Bumped whenever processing changes so that every page is processed again
+VERSION = 2
+
+# A <pre> containing token spans, whichever class marks it
+HIGHLIGHTED_RE = re.compile(r"<pre\b[^>]*>(?:(?!</pre>).)*?<span class=", re.S)
+
+# Marks processed pages, which must never be processed again
+MARKER = '<meta name="rstblog-postprocess" content="{}" />'
+MARKER_RE = re.compile(r"<meta name=\"rstblog-postprocess\"")
+# Only a rel attribute, not the onload handler of a deferred stylesheet
+LINK_RE = re.compile(r"<link\b[^>]*\srel=[\"']?stylesheet[\"'\s/>][^>]*>", re.I)
+HREF_RE = re.compile(r"\shref=[\"']?([^\"'\s>]+)", re.I)
+HEAD_RE = re.compile(r"<head\b[^>]*>", re.I)
+BODY_RE = re.compile(r"<body\b[^>]*>", re.I)
+TAG_RE = re.compile(r"<([a-zA-Z][\w-]*)")
+# Elements whose content is whitespace sensitive, and comments
+PRESERVE_RE = re.compile(
+    r"(<(pre|textarea|script|style|code)\b.*?</\2\s*>)|(<!--.*?-->)", re.S | re.I
+)
+WHITESPACE_RE = re.compile(r"\s+")
+# A custom property declaration in minified CSS, and a reference to one
+PROPERTY_RE = re.compile(
+    r"""(?<=[{;])(--[\w-]+):"""
+    r"""(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[^;{}"'])*(;|(?=}))"""
+)
+VAR_RE = re.compile(r"var\(\s*(--[\w-]+)")
+EMPTY_RULE_RE = re.compile(r"(?:(?<=[{}])|^)[^{};]+\{\}")
+
+
+def minify(html):
+    """
+    Collapses runs of whitespace and removes comments, leaving the content of
+    whitespace sensitive elements untouched. Whitespace is never removed
+    entirely, since it is significant between inline elements.
+    """
+    out = []
+    pos = 0
+    for m in PRESERVE_RE.finditer(html):
+        out.append(WHITESPACE_RE.sub(" ", html[pos : m.start()]))
+        if m.group(1):
+            out.append(m.group(1))
+        elif m.group(3).startswith("<!--[if"):
+            # Conditional comments are markup
+            out.append(m.group(3))
+        pos = m.end()
+    out.append(WHITESPACE_RE.sub(" ", html[pos:]))
+    return "".join(out).strip() + "\n"
+
+
+@functools.lru_cache(maxsize=None)
+def read_stylesheet(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=None)
+def critical_css(paths, classes, elements):
+    """
+    Returns the rules of the stylesheets needed by the passed classes and
+    elements. Pages share their layout, so this is usually cached.
+    """
+    css, _ = strip_comments("".join(read_stylesheet(p) for p in paths))
+    # Imports would block rendering again and @charset is ignored in <style>.
+    # The licenses and print styles stay with the deferred stylesheets.
+    css = "".join(
+        f"{prelude}{{{block}}}" if block is not None else f"{prelude};"
+        for prelude, block in split_rules(css)
+        if (block is not None or not prelude.startswith(("@import", "@charset")))
+        and not prelude.startswith("@media print")
+    )
+    return drop_unused_properties(prune(css, classes, elements))
+
+
+def drop_unused_properties(css):
+    """
+    Removes the declarations of custom properties which the rules of a
+    minified stylesheet don't reference, such as most of a theme's variables
+    """
+    definitions = {}
+    for m in PROPERTY_RE.finditer(css):
+        definitions.setdefault(m.group(1), []).append(m.group(0))
+    pending = set(VAR_RE.findall(PROPERTY_RE.sub("", css)))
+    used = set()
+    while pending:
+        name = pending.pop()
+        used.add(name)
+        for d in definitions.get(name, []):
+            pending.update(set(VAR_RE.findall(d)) - used)
+    css = PROPERTY_RE.sub(lambda m: m.group(0) if m.group(1) in used else "", css)
+    # Trailing semicolons left before the end of a block are harmless, empty
+    # rules are not worth sending
+    while EMPTY_RULE_RE.search(css):
+        css = EMPTY_RULE_RE.sub("", css)
+    return css
+
+
+def above_the_fold(html, fold):
+    """
+    Returns the classes and elements used by the start of the page's body
+    """
+    body = BODY_RE.search(html)
+    start = body.end() if body else 0
+    markup = html[start : start + fold]
+    elements = set(t.lower() for t in TAG_RE.findall(markup)) | {"html", "body"}
+    return frozenset(html_classes(markup)), frozenset(elements)
+
+
+def _deferred(link, href):
+    """
+    Loads a stylesheet without blocking rendering, falling back to a normal
+    link without JavaScript
+    """
+    return (
+        f'<link rel="preload" href="{href}" as="style" '
+        "onload=\"this.onload=null;this.rel='stylesheet'\" />"
+        f"<noscript>{link}</noscript>"
+    )
+
+
+def _mark(html):
+    head = HEAD_RE.search(html)
+    pos = head.end() if head else 0
+    return html[:pos] + MARKER.format(VERSION) + html[pos:]
+
+
+def process(html, resolve, settings, locate=None, sizes=None):
+    """
+    Processes a page as rendered by rstblog, returning the new HTML and the
+    paths of the stylesheets it used. resolve maps a stylesheet's href to its
+    file, or None. locate maps the src of an image to its rstblog-images
+    manifest entry, or None, and sizes is the sizes attribute of the images.
+    """
+    if MARKER_RE.search(html):
+        raise ValueError("The page has already been processed")
+    if locate is not None:
+        html = responsive(html, locate, sizes)
+    # Any <pre> with token spans is highlighted code, whichever class marks it
+    has_code = HIGHLIGHTED_RE.search(html) is not None
+    links = []
+    for m in LINK_RE.finditer(html):
+        href = HREF_RE.search(m.group(0))
+        links.append((m, href and href.group(1)))
+    kept = []
+    out = []
+    pos = 0
+    for m, href in links:
+        out.append(html[pos : m.start()])
+        pos = m.end()
+        path = resolve(href) if href else None
+        name = href.rsplit("/", 1)[-1] if href else ""
+        if (
+            path is not None
+            and not has_code
+            and name.startswith(settings["code_stylesheet"])
+        ):
+            continue
+        if path is None:
+            _log.warning(f"Unable to find stylesheet {href}, leaving it blocking")
+            out.append(m.group(0))
+            continue
+        kept.append(path)
+        # The critical CSS is inserted where the first stylesheet was
+        out.append("\0" if len(kept) == 1 else "")
+        out.append(_deferred(m.group(0), href))
+    out.append(html[pos:])
+    html = "".join(out)
+    if kept:
+        classes, elements = above_the_fold(html, settings["fold"])
+        critical = critical_css(tuple(str(p) for p in kept), classes, elements)
+        html = html.replace("\0", f"<style>{critical}</style>", 1)
+    return minify(_mark(html)), [str(p) for p in kept]
+
+
+class OriginalCache:
+    """
+    The pages as rendered by rstblog, stored one file per page named by its
+    hash
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def file(self, digest):
+        return self.path / digest[:2] / f"{digest}.html"
+
+    def keys(self):
+        return set(f.stem for f in self.path.glob("*/*.html"))
+
+    def remove(self, digest):
+        self.file(digest).unlink(missing_ok=True)
+
+
+def page_bases(path, site):
+    """
+    The URLs which relative references on a rendered page may be relative to:
+    its directory, and for pages other than an index, the page served as a
+    directory
+    """
+    relative = path.relative_to(site)
+    parent = relative.parent.as_posix()
+    base = "/" if parent == "." else f"/{parent}/"
+    if relative.name == "index.html":
+        return [base]
+    return [base, f"{base}{relative.stem}/"]
+
+
+def _process_job(job):
+    path, source, original, site, root, settings, manifest, sizes = job
+
+    def resolve(href):
+        if re.match(r"^([a-z]+:)?//", href, re.I):
+            return None
+        relative = href.split("?")[0].lstrip("/")
+        for base in (site, root):
+            if (candidate := base / relative).is_file():
+                return candidate
+        return None
+
+    with open(source, encoding="utf-8") as f:
+        html = f.read()
+    if not original.is_file():
+        write_atomic(original, html)
+    locate = locator(manifest, page_bases(path, site)) if manifest else None
+    processed, stylesheets = process(html, resolve, settings, locate, sizes)
+    write_atomic(path, processed)
+    return file_hash(path), dict((s, file_hash(s)) for s in stylesheets)
+
+
+def _up_to_date(entry, settings_key):
+    return entry["settings"] == settings_key and all(
+        pathlib.Path(s).is_file() and file_hash(s) == h
+        for s, h in entry["stylesheets"].items()
+    )
+
+
+def build(root=".", config=None, site=None, jobs=None):
+    """
+    Processes every page in the site which rstblog rendered since the last
+    build, and processes pages again from the page rstblog rendered when the
+    settings or their stylesheets changed
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("postprocess", {}))
+    site = site_dir(config, root, site if site is not None else settings["site"])
+    if site is None:
+        raise ValueError("The directory containing the rendered site must be set")
+    cache = JsonCache(cache_dir(config, root) / "postprocess.json")
+    originals = OriginalCache(cache_dir(config, root) / "postprocess")
+    images = dict(IMAGE_SETTINGS, **config.get("images", {}))
+    try:
+        with open(root / images["manifest"], encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    settings_key = text_hash(
+        json.dumps([settings, manifest, images["sizes"]], sort_keys=True),
+        str(VERSION),
+    )
+    stale = []
+    skipped = 0
+    sources = set()
+    pages = sorted(site.rglob("*.html"))
+    for path in pages:
+        name = path.resolve().as_posix()
+        digest = file_hash(path)
+        entry = cache.get(name)
+        if entry is not None and entry.get("output") == digest:
+            # Processed by an earlier build
+            original = originals.file(entry["source"])
+            if _up_to_date(entry, settings_key):
+                cache.put(name, entry)
+                sources.add(entry["source"])
+            elif original.is_file():
+                stale.append((path, original, entry["source"]))
+            else:
+                skipped += 1
+            continue
+        with open(path, encoding="utf-8") as f:
+            if MARKER_RE.search(f.read()):
+                # Processed, but the page it was processed from is unknown
+                skipped += 1
+                continue
+        stale.append((path, path, digest))
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            work = [
+                (
+                    path,
+                    source,
+                    originals.file(digest),
+                    site,
+                    root,
+                    settings,
+                    manifest,
+                    images["sizes"],
+                )
+                for path, source, digest in stale
+            ]
+            results = pool.map(_process_job, work, chunksize=8)
+            for (path, _, digest), (output, stylesheets) in zip(stale, results):
+                cache.put(
+                    path.resolve().as_posix(),
+                    {
+                        "source": digest,
+                        "output": output,
+                        "settings": settings_key,
+                        "stylesheets": stylesheets,
+                    },
+                )
+                sources.add(digest)
+    if skipped:
+        _log.warning(
+            f"{skipped} pages were already processed but their rendered pages "
+            "aren't cached, render them again to process them"
+        )
+    cache.save()
+    # Only keep the rendered pages which may need to be processed again
+    for digest in originals.keys() - sources:
+        originals.remove(digest)
+    _log.info(f"Processed {len(stale)} of {len(pages)} pages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("--site", help="Directory containing the rendered site")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root, site=args.site, jobs=args.jobs)
@@ -0,0 +1,234 @@
+"""
+Pre-renders the preview of every post (its content before the rstblog-break)
+into a template which index.j2 includes, so that paginated index pages reuse
+the rendered previews rather than rendering each post again. Each preview
+records the hash of its source and is only rendered again when it changes.
+rstblog-test renders the previews again before refreshing rstblog, so an
+edited post never keeps its old preview.
+
+Previews containing directives which rstblog renders itself (code blocks, with
+their highlighting and :height-limit:) aren't pre-rendered, since docutils
+alone can't reproduce them. index.j2 falls back to preview-default.j2 for those
+and for any post without a preview, and each preview falls back to it as well
+when rstblog's title for the post no longer matches the one it was rendered
+with. Run with --check to find previews whose source has changed since they
+were rendered.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import pathlib
+import re
+import sys
+import urllib.parse
+
+from .cache import text_hash, write_atomic
+from .config import load_config
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "output": "./previews",
+}
+
+# Bumped whenever the rendering changes so that rendered previews are discarded
+VERSION = 3
+
+# Directives rendered by rstblog rather than by docutils
+RSTBLOG_DIRECTIVES = ("code-block",)
+
+HEADER = "{{# Generated by rstblog-preview from source {}. Do not edit. #}}"
+HEADER_RE = re.compile(r"\{# Generated by rstblog-preview from source (\w+)\.")
+
+RENDER_SETTINGS = {
+    "report_level": 5,
+    "halt_level": 5,
+    "warning_stream": False,
+    "doctitle_xform": False,
+    "file_insertion_enabled": False,
+    "raw_enabled": False,
+    # Only reached by whole documents rendered by rstblog-prunecss, for which
+    # the token spans don't matter
+    "syntax_highlight": "none",
+}
+
+
+def preview_source(document):
+    """
+    Source of the document's preview: everything before its rstblog-break, or
+    the whole document without its settings if it has no break
+    """
+    if (preview := document.preview) is not None:
+        return preview
+    lines = document.text.splitlines()
+    for d in document.directives:
+        if d.name == "rstblog-settings":
+            lines[d.line - 1 : d.end] = [""] * (d.end - d.line + 1)
+    return "\n".join(lines).strip() + "\n"
+
+
+def pre_renderable(document, source):
+    """
+    Returns whether the preview source can be rendered the same way rstblog
+    renders it
+    """
+    preview = Document(document.path, source)
+    return not any(d.name in RSTBLOG_DIRECTIVES for d in preview.directives)
+
+
+def _absolute(uri, url):
+    """
+    Makes a URI relative to the post absolute, since the preview is shown on
+    pages at other locations
+    """
+    if urllib.parse.urlparse(uri).scheme or uri.startswith(("/", "#")):
+        return uri
+    return f"/{url}/{uri}"
+
+
+def render(source, url):
+    from docutils import nodes
+    from docutils.core import publish_doctree, publish_from_doctree
+    from docutils.writers.html5_polyglot import Writer
+
+    from .validate import register_directives
+
+    register_directives()
+    doctree = publish_doctree(source, settings_overrides=RENDER_SETTINGS)
+    for node in doctree.findall(nodes.image):
+        node["uri"] = _absolute(node["uri"], url)
+    for node in doctree.findall(nodes.reference):
+        if "refuri" in node:
+            node["refuri"] = _absolute(node["refuri"], url)
+    writer = Writer()
+    publish_from_doctree(doctree, writer=writer, settings_overrides=RENDER_SETTINGS)
+    return writer.parts["fragment"]
+
+
+def _render_job(job):
+    return render(*job)
+
+
+def render_include(html, key, title):
+    """
+    Wraps the rendered preview in a raw block so Jinja outputs it untouched,
+    recording the key of the source it was rendered from. The preview is only
+    used while rstblog's title for the post matches the one it was rendered
+    with.
+    """
+    return "\n".join(
+        [
+            HEADER.format(key),
+            f"{{% if page.title == {json.dumps(title)} %}}{{% raw %}}",
+            html,
+            '{% endraw %}{% else %}{% include "preview-default.j2" %}{% endif %}\n',
+        ]
+    )
+
+
+def rendered_key(path):
+    """
+    Returns the key recorded in a rendered preview, or None if there is no
+    preview at path or it doesn't record one
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            m = HEADER_RE.match(f.readline())
+    except FileNotFoundError:
+        return None
+    return m.group(1) if m else None
+
+
+def preview_keys(root, config):
+    """
+    Returns a dict of post URL to the key of its preview source and title, for
+    every post whose preview can be pre-rendered, along with a dict of post URL
+    to its source and title
+    """
+    posts = root / config.get("paths", {}).get("posts", "./posts")
+    keys = {}
+    sources = {}
+    for path in find_documents([posts]):
+        document = Document.load(path)
+        if not (url := document.url):
+            continue
+        source = preview_source(document)
+        if not pre_renderable(document, source):
+            continue
+        keys[url] = text_hash(source, url, document.title, str(VERSION))
+        sources[url] = (source, document.title)
+    return keys, sources
+
+
+def stale_previews(root=".", config=None):
+    """
+    Returns the URLs of the rendered previews which don't match the current
+    source of their post, or whose post no longer has a pre-renderable preview
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("previews", {}))
+    output = root / settings["output"]
+    keys, _ = preview_keys(root, config)
+    stale = []
+    for f in sorted(output.rglob("*.j2")):
+        url = f.relative_to(output).with_suffix("").as_posix()
+        if rendered_key(f) != keys.get(url):
+            stale.append(url)
+    return stale
+
+
+def build(root=".", config=None, jobs=None):
+    """
+    Renders the preview of every post whose source changed since it was last
+    rendered, returning a dict of post URL to preview key
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("previews", {}))
+    output = root / settings["output"]
+    keys, sources = preview_keys(root, config)
+    stale = [u for u, k in keys.items() if rendered_key(output / f"{u}.j2") != k]
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            work = [(sources[url][0], url) for url in stale]
+            for url, html in zip(stale, pool.map(_render_job, work)):
+                include = render_include(html, keys[url], sources[url][1])
+                write_atomic(output / f"{url}.j2", include)
+    # Remove the previews of posts which were removed, moved or can no longer
+    # be pre-rendered, so that index.j2 falls back to rstblog's preview
+    for f in output.rglob("*.j2"):
+        if f.relative_to(output).with_suffix("").as_posix() not in keys:
+            f.unlink()
+    _log.info(f"Rendered {len(stale)} of {len(keys)} previews")
+    return keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Report previews which are out of date with their post, writing nothing",
+    )
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    if args.check:
+        stale = stale_previews(args.root)
+        for url in stale:
+            _log.error(f"The preview of {url} is out of date")
+        if stale:
+            sys.exit(1)
+        return
+    build(args.root, jobs=args.jobs)
@@ -0,0 +1,315 @@
+"""
+Prunes the rules of unused classes from the stylesheets, keeping only what
+the templates and the rendered posts and pages use, and writes minified
+copies. The pruned stylesheets are only rebuilt when the set of classes in use
+or the source stylesheets change.
+
+Documents are rendered with docutils, whose output differs from rstblog's in
+places, so the pages of the rendered site are scanned as well when it is
+available.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import pathlib
+import re
+
+from .cache import JsonCache, cache_dir, file_hash, text_hash, write_atomic
+from .config import load_config, content_dirs, site_dir
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    # Source stylesheet to the pruned copy written in its place in static.j2
+    "stylesheets": {"css/bootstrap.min.css": "css/bootstrap.pruned.css"},
+    # Classes which are used but can't be found by scanning, such as those
+    # added by scripts
+    "keep": [],
+}
+
+# Bumped whenever pruning changes so that pruned stylesheets are rebuilt
+VERSION = 1
+
+CLASS_ATTR_RE = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+JINJA_RE = re.compile(r"{{.*?}}|{%.*?%}|{#.*?#}", re.S)
+# Classes set by scripts through className or classList
+SCRIPT_CLASS_RE = re.compile(
+    r"""\bclassName\s*=\s*(?:"([^"]*)"|'([^']*)')"""
+    r"""|\bclassList\.(?:add|toggle|replace)\(([^)]*)\)"""
+)
+SCRIPT_STRING_RE = re.compile(r""""([^"]*)"|'([^']*)'""")
+SELECTOR_CLASS_RE = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+# Arguments of functional pseudo-classes like :not(.a) don't need to match
+PSEUDO_ARGS_RE = re.compile(r"\([^()]*\)")
+ATTRIBUTE_RE = re.compile(r"\[[^\]]*\]")
+# Element names, as opposed to the names of classes, ids and pseudo-classes
+SELECTOR_TYPE_RE = re.compile(r"(?<![\w.#:-])([a-zA-Z][\w-]*)")
+COMMENT_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/""", re.S)
+STRING_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+# At-rules whose blocks contain rules to prune rather than declarations
+GROUPING_RULES = ("@media", "@supports", "@container", "@layer")
+
+
+def html_classes(text):
+    """
+    Returns the literal class names used in HTML or a Jinja template
+    """
+    classes = set()
+    for m in CLASS_ATTR_RE.finditer(text):
+        value = JINJA_RE.sub(" ", m.group(1) or m.group(2) or "")
+        classes.update(value.split())
+    return classes
+
+
+def script_classes(text):
+    """
+    Returns the literal class names a script sets on elements
+    """
+    classes = set()
+    for m in SCRIPT_CLASS_RE.finditer(text):
+        if m.group(3) is None:
+            classes.update((m.group(1) or m.group(2) or "").split())
+            continue
+        for s in SCRIPT_STRING_RE.finditer(m.group(3)):
+            classes.update((s.group(1) or s.group(2) or "").split())
+    return classes
+
+
+def document_classes(path):
+    """
+    Renders a document to HTML and returns the classes it uses
+    """
+    from .preview import render
+
+    document = Document.load(path)
+    return sorted(html_classes(render(document.text, document.url)))
+
+
+def strip_comments(css):
+    """
+    Removes the comments from a stylesheet, returning it along with the /*!
+    license comments which must be preserved
+    """
+    licenses = []
+
+    def replace(m):
+        if m.group(1):
+            return m.group(1)
+        if m.group(0).startswith("/*!"):
+            licenses.append(m.group(0))
+        return ""
+
+    return COMMENT_RE.sub(replace, css), licenses
+
+
+def split_rules(css):
+    """
+    Splits a stylesheet without comments into its top level statements:
+    (prelude, block) for rules and at-rules with a block, or (statement, None)
+    for statements like @import
+    """
+    statements = []
+    depth = 0
+    parens = 0
+    start = 0
+    prelude = None
+    i = 0
+    while i < len(css):
+        c = css[i]
+        if c in "\"'":
+            i = STRING_RE.match(css, i).end()
+            continue
+        if c == "(":
+            parens += 1
+        elif c == ")":
+            parens -= 1
+        elif parens:
+            pass
+        elif c == "{":
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                statements.append((prelude, css[start:i]))
+                start = i + 1
+        elif c == ";" and depth == 0:
+            statements.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return statements
+
+
+def _selector_used(selector, used, elements=None):
+    selector = STRING_RE.sub("", selector)
+    while PSEUDO_ARGS_RE.search(selector):
+        selector = PSEUDO_ARGS_RE.sub("", selector)
+    if not all(c in used for c in SELECTOR_CLASS_RE.findall(selector)):
+        return False
+    if elements is None:
+        return True
+    types = SELECTOR_TYPE_RE.findall(ATTRIBUTE_RE.sub("", selector))
+    return all(t.lower() in elements for t in types)
+
+
+def _split_selectors(prelude):
+    selectors = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(prelude):
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == "," and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [s.strip() for s in selectors]
+
+
+def _minify(text):
+    parts = STRING_RE.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s*([{};,])\s*", r"\1", re.sub(r"\s+", " ", parts[i]))
+    return "".join(parts).strip()
+
+
+def _prune_rules(css, used, elements=None):
+    out = []
+    for prelude, block in split_rules(css):
+        if block is None:
+            out.append(_minify(prelude) + ";")
+        elif prelude.startswith(GROUPING_RULES):
+            if inner := _prune_rules(block, used, elements):
+                out.append(f"{_minify(prelude)}{{{inner}}}")
+        elif prelude.startswith("@"):
+            # @font-face, @keyframes, @page and the like are kept whole
+            out.append(f"{_minify(prelude)}{{{_minify(block)}}}")
+        else:
+            selectors = [
+                s
+                for s in _split_selectors(prelude)
+                if _selector_used(s, used, elements)
+            ]
+            if selectors:
+                out.append(f"{_minify(','.join(selectors))}{{{_minify(block)}}}")
+    return "".join(out)
+
+
+def prune(css, used, elements=None):
+    """
+    Removes the rules from the stylesheet whose selectors use classes not in
+    used, or elements not in elements if it is passed, returning the minified
+    result
+    """
+    css, licenses = strip_comments(css)
+    rules = _prune_rules(css, used, elements)
+    # @charset has to stay at the very start
+    charset = ""
+    if rules.startswith("@charset"):
+        charset, rules = rules.split(";", 1)
+        charset += ";"
+    return charset + "".join(f"{l}\n" for l in licenses) + rules
+
+
+def site_classes(site, cache):
+    """
+    Returns the classes used by the pages of the rendered site, only reading
+    the pages which changed since they were last scanned
+    """
+    used = set()
+    for path in sorted(site.rglob("*.html")):
+        name = f"site:{path.relative_to(site).as_posix()}"
+        digest = file_hash(path)
+        if (entry := cache.get(name)) is None or entry["hash"] != digest:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                entry = {"hash": digest, "classes": sorted(html_classes(f.read()))}
+        cache.put(name, entry)
+        used.update(entry["classes"])
+    return used
+
+
+def used_classes(root, config, settings, jobs=None, site=None):
+    """
+    Collects the classes used by the templates, the scripts, the rendered
+    documents and, if it is available, the rendered site. Documents are only rendered again
+    when they change.
+    """
+    used = set(settings["keep"])
+    for template in sorted(root.glob("*.j2")):
+        used |= html_classes(template.read_text())
+    for d in config.get("paths", {}).get("static", []):
+        for script in sorted((root / d).rglob("*.js")):
+            used |= script_classes(script.read_text(encoding="utf-8"))
+    cache = JsonCache(cache_dir(config, root) / "prune.json")
+    stale = []
+    for path in find_documents(content_dirs(config, root)):
+        name = path.relative_to(root).as_posix()
+        digest = text_hash(file_hash(path), str(VERSION))
+        if (entry := cache.get(name)) is not None and entry["hash"] == digest:
+            used.update(entry["classes"])
+            cache.put(name, entry)
+        else:
+            stale.append((path, name, digest))
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            work = [path for path, _, _ in stale]
+            for (_, name, digest), classes in zip(
+                stale, pool.map(document_classes, work)
+            ):
+                cache.put(name, {"hash": digest, "classes": classes})
+                used.update(classes)
+    _log.info(f"Rendered {len(stale)} documents to find the classes in use")
+    if (site := site_dir(config, root, site)) is not None:
+        used |= site_classes(site, cache)
+    return used, cache
+
+
+def build(root=".", config=None, jobs=None, site=None):
+    """
+    Writes the pruned copy of each stylesheet whose source or classes in use
+    changed since the last build
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("prune", {}))
+    used, cache = used_classes(root, config, settings, jobs, site)
+    classes_key = text_hash(json.dumps(sorted(used)))
+    for source, output in settings["stylesheets"].items():
+        source, output = root / source, root / output
+        key = text_hash(file_hash(source), classes_key, str(VERSION))
+        if cache.get(f"stylesheet:{output.name}") == key and output.is_file():
+            _log.info(f"{output.name} is up to date")
+        else:
+            with open(source, encoding="utf-8") as f:
+                css = f.read()
+            pruned = prune(css, used)
+            write_atomic(output, pruned + "\n")
+            _log.info(
+                f"Pruned {source.name} from {len(css) // 1024}KiB to "
+                f"{len(pruned) // 1024}KiB as {output.name}"
+            )
+        cache.put(f"stylesheet:{output.name}", key)
+    cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("--site", help="Directory containing the rendered site")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root, jobs=args.jobs, site=args.site)
@@ -0,0 +1,224 @@
+"""
+Builds a static full-text search index of the posts and pages.
+
+The index is an inverted index with positional postings, split into shards by
+a hash of each term so that the browser only downloads the shards for the terms
+being searched. Code blocks are indexed separately from prose.
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+import re
+
+from .cache import JsonCache, cache_dir, file_hash, write_atomic
+from .config import load_config, content_dirs
+from .content import Document, find_documents
+from .static import compress
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "output": "./search",
+    "shards": 8,
+    "max_shard_kib": 64,
+    "index_code": True,
+}
+
+FIELDS = ("text", "code")
+
+# Bumped whenever the on-disk format or tokenization changes so that cached
+# postings are discarded
+VERSION = 1
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Directives whose bodies are prose which should be searchable
+PROSE_DIRECTIVES = ("figure", "note", "warning", "admonition")
+
+INLINE_RES = [
+    # `text <target>`_ and `text <target>`__
+    (re.compile(r"`([^`<]*?)\s*<[^`>]*>`__?"), r"\1"),
+    # :role:`text`
+    (re.compile(r":[\w-]+:`([^`]*)`"), r"\1"),
+    # ``literal``, *emphasis*, **strong**, `interpreted`
+    (re.compile(r"``|\*\*|\*|`"), ""),
+    (re.compile(r"\\(.)"), r"\1"),
+]
+SECTION_RE = re.compile(r"^\s*([=\-~^\"'`#*+])\1{2,}\s*$")
+EXPLICIT_RE = re.compile(r"^\s*\.\. ")
+
+
+def fnv1a(term):
+    """
+    32-bit FNV-1a hash of the term's UTF-8 bytes, used to pick its shard. The
+    search client implements the same function.
+    """
+    h = 0x811C9DC5
+    for b in term.encode("utf-8"):
+        h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+def tokenize(text):
+    return [t.lower() for t in TOKEN_RE.findall(text)]
+
+
+def extract(document):
+    """
+    Splits a document into its prose and its code, with markup removed
+    """
+    lines = document.text.splitlines()
+    keep = [True] * len(lines)
+    code = []
+    for d in document.directives:
+        end = d.end if d.name not in PROSE_DIRECTIVES else d.header_end
+        for i in range(d.line - 1, end):
+            keep[i] = False
+        if d.name == "code-block":
+            code.append(d.body_text)
+    prose = [document.title]
+    for line, k in zip(lines, keep):
+        if not k or SECTION_RE.match(line) or EXPLICIT_RE.match(line):
+            continue
+        for regex, replacement in INLINE_RES:
+            line = regex.sub(replacement, line)
+        prose.append(line)
+    return "\n".join(prose), "\n".join(code)
+
+
+def postings(text):
+    """
+    Maps each term in the text to the positions at which it appears
+    """
+    terms = {}
+    for i, t in enumerate(tokenize(text)):
+        terms.setdefault(t, []).append(i)
+    return terms
+
+
+def index_document(path, settings):
+    document = Document.load(path)
+    text, code = extract(document)
+    date = document.date
+    return {
+        "doc": {
+            "url": document.url,
+            "title": document.title,
+            "date": date.date().isoformat() if date else None,
+        },
+        "text": postings(text),
+        "code": postings(code) if settings["index_code"] else {},
+    }
+
+
+def shard(entries, field, count):
+    """
+    Merges the postings of a field across all documents into count shards.
+    Positions are delta encoded: [doc, first, second - first, ...].
+    """
+    shards = [{} for _ in range(count)]
+    for doc_id, entry in enumerate(entries):
+        for term, positions in entry[field].items():
+            deltas = [positions[0]] + [b - a for a, b in zip(positions, positions[1:])]
+            s = shards[fnv1a(term) % count]
+            s.setdefault(term, []).append([doc_id] + deltas)
+    return [
+        json.dumps(s, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+        for s in shards
+    ]
+
+
+def _write_if_changed(path, data):
+    """
+    Writes the file (and its compressed siblings) only if its content changed,
+    so that unchanged shards keep their timestamps and cache validators
+    """
+    data = data.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomic(path, data)
+    compress(path, data)
+    return True
+
+
+def build(root=".", config=None):
+    """
+    Builds the search index, re-tokenizing only the documents which changed
+    since the last build
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("search", {}))
+    output = root / settings["output"]
+    cache = JsonCache(cache_dir(config, root) / "search.json")
+    entries = []
+    for path in find_documents(content_dirs(config, root)):
+        name = path.relative_to(root).as_posix()
+        digest = file_hash(path)
+        entry = cache.get(name)
+        if (
+            entry is None
+            or entry["hash"] != digest
+            or entry["version"] != VERSION
+            or entry["index_code"] != settings["index_code"]
+        ):
+            _log.info(f"Indexing {name}")
+            entry = dict(
+                index_document(path, settings),
+                hash=digest,
+                version=VERSION,
+                index_code=settings["index_code"],
+            )
+        cache.put(name, entry)
+        if entry["doc"]["url"]:
+            entries.append(entry)
+    cache.save()
+    fields = [f for f in FIELDS if f == "text" or settings["index_code"]]
+    # Double the shard count until every shard fits within the download budget
+    count = settings["shards"]
+    limit = settings["max_shard_kib"] * 1024
+    while True:
+        shards = dict((f, shard(entries, f, count)) for f in fields)
+        largest = max(len(s.encode("utf-8")) for f in fields for s in shards[f])
+        if largest <= limit or count >= 1024:
+            break
+        count *= 2
+    written = 0
+    for field, field_shards in shards.items():
+        for i, data in enumerate(field_shards):
+            written += _write_if_changed(output / f"{field}-{i}.json", data)
+    meta = {
+        "version": VERSION,
+        "shards": count,
+        "fields": fields,
+        "docs": [e["doc"] for e in entries],
+    }
+    written += _write_if_changed(
+        output / "meta.json", json.dumps(meta, separators=(",", ":"), sort_keys=True)
+    )
+    # Remove shards left over from a larger index or a dropped field
+    for f in output.glob("*-*.json*"):
+        field, number = f.name.split(".")[0].split("-")
+        if field not in fields or int(number) >= count:
+            f.unlink()
+    _log.info(f"Indexed {len(entries)} documents into {count} shards per field")
+    _log.info(f"{written} index files changed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root)
@@ -0,0 +1,188 @@
+"""
+Renders the "Recent posts / Date / Tags" sidebar of base.j2 once per build
+into a template which base.j2 includes verbatim, rather than every page
+looping over all of the posts to build the same sidebar. The fragment is only
+rewritten when the metadata of the posts changes.
+
+The month and tag URL formats can't be taken from rstblog, so the fragment is
+only written once its links have been checked against the rendered site
+(paths.site or --site). It also falls back to sidebar-default.j2 when rstblog's
+posts no longer match the ones it was rendered from, so a stale sidebar.j2 is
+never shown.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import html
+import json
+import logging
+import pathlib
+
+from .cache import JsonCache, cache_dir, text_hash, write_atomic
+from .config import load_config, site_dir
+from .content import Document, find_documents
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "output": "./sidebar.j2",
+    "recent": 5,
+    # Site-relative URLs of the month and tag listings generated by rstblog
+    "month_url": "{date:%Y/%m}",
+    "tag_url": "tag/{tag}",
+}
+
+# Bumped whenever the rendering changes so that the sidebar is rendered again
+VERSION = 2
+
+
+def metadata(path):
+    document = Document.load(path)
+    date = document.date
+    return {
+        "url": document.url,
+        "title": document.title,
+        "date": date.isoformat() if date else None,
+        "tags": document.tags,
+    }
+
+
+def metadata_index(root, config):
+    """
+    Returns the metadata of every post, newest first
+    """
+    posts = root / config.get("paths", {}).get("posts", "./posts")
+    with ThreadPoolExecutor() as pool:
+        index = list(pool.map(metadata, find_documents([posts])))
+    index = [p for p in index if p["url"] and p["date"]]
+    index.sort(key=lambda p: p["date"], reverse=True)
+    return index
+
+
+def _badge(url, text):
+    return (
+        f'<a class="badge rounded-pill text-primary bg-dark" '
+        f'href="/{html.escape(url)}">{html.escape(text)}</a>'
+    )
+
+
+def listings(index, settings):
+    """
+    Returns the (URL, text) of the month and of the tag listings linked by the
+    sidebar, newest month first and tags by name
+    """
+    from dateutil import parser
+
+    months = {}
+    for post in index:
+        date = parser.parse(post["date"])
+        months.setdefault((date.year, date.month), date)
+    months = [
+        (settings["month_url"].format(date=d), d.strftime("%b %Y"))
+        for d in months.values()
+    ]
+    tags = sorted(set(t for post in index for t in post["tags"]))
+    tags = [(settings["tag_url"].format(tag=t), t) for t in tags]
+    return months, tags
+
+
+def missing_listings(site, urls):
+    """
+    Returns the URLs which aren't pages of the rendered site
+    """
+    return [
+        u
+        for u in urls
+        if not any(
+            p.is_file() for p in (site / u, site / u / "index.html", site / f"{u}.html")
+        )
+    ]
+
+
+def render(index, settings):
+    """
+    Renders the sidebar for the passed metadata index. The result is wrapped
+    in a raw block so that Jinja outputs it untouched, guarded by a check that
+    rstblog's newest post and number of months and tags are still the same.
+    """
+    months, tags = listings(index, settings)
+    newest = json.dumps(index[0]["url"] if index else "")
+    lines = [
+        "{# Generated by rstblog-sidebar. Do not edit. #}",
+        f"{{% if (posts|first).url == {newest} and posts_by_month|length == "
+        f"{len(months)} and posts_by_tag|length == {len(tags)} %}}",
+        "{% raw %}",
+    ]
+    lines.append("<h4>Recent posts</h4>")
+    for post in index[: settings["recent"]]:
+        url, title = html.escape(post["url"]), html.escape(post["title"])
+        lines.append(f'<a href="/{url}">{title}</a><br />')
+    lines.append("<h4>Date</h4>")
+    lines.extend(_badge(url, text) for url, text in months)
+    lines.append("<h4>Tags</h4>")
+    lines.extend(_badge(url, text) for url, text in tags)
+    lines.extend(
+        [
+            "{% endraw %}",
+            "{% else %}",
+            "{# Posts changed since rstblog-sidebar last ran #}",
+            '{% include "sidebar-default.j2" %}',
+            "{% endif %}",
+        ]
+    )
+    return "\n".join(lines) + "\n"
+
+
+def build(root=".", config=None, site=None):
+    """
+    Rewrites the sidebar if the metadata index changed since the last build,
+    returning the hash of the index. If there is no rendered site to check the
+    links against, or they don't match it, the sidebar is removed so that
+    base.j2 uses sidebar-default.j2, and None is returned.
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("sidebar", {}))
+    index = metadata_index(root, config)
+    output = root / settings["output"]
+    if (site := site_dir(config, root, site)) is None:
+        _log.warning(
+            "The site isn't rendered locally, so the sidebar links can't be "
+            "checked; leaving the sidebar to sidebar-default.j2"
+        )
+        output.unlink(missing_ok=True)
+        return None
+    months, tags = listings(index, settings)
+    if missing := missing_listings(site, [u for u, _ in months + tags]):
+        _log.error(
+            f"{len(missing)} sidebar links aren't pages of {site}, e.g. "
+            f"/{missing[0]}. Check month_url and tag_url in [tool.rstblog.sidebar] "
+            "or render the site again; falling back to sidebar-default.j2."
+        )
+        output.unlink(missing_ok=True)
+        return None
+    key = text_hash(json.dumps([index, settings], sort_keys=True), str(VERSION))
+    cache = JsonCache(cache_dir(config, root) / "sidebar.json")
+    if cache.get("key") != key or not output.is_file():
+        _log.info(f"Rendering the sidebar of {len(index)} posts to {output}")
+        write_atomic(output, render(index, settings))
+    else:
+        _log.info("Sidebar is up to date")
+    cache.put("key", key)
+    cache.save()
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("--site", help="Directory containing the rendered site")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    build(args.root, site=args.site)
@@ -0,0 +1,217 @@
+"""
+Builds long-cacheable copies of the static assets: content-hashed filenames
+with precompressed gzip and brotli siblings, plus a manifest and an include for
+base.j2 which links the stylesheets and scripts
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import pathlib
+import re
+import shutil
+import time
+
+from .cache import JsonCache, cache_dir, file_hash, write_atomic
+from .config import load_config
+from .prune import DEFAULT_SETTINGS as PRUNE_SETTINGS
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "sources": ["./css", "./js"],
+    "output": "./assets",
+    "manifest": "./assets/manifest.json",
+    "include": "./static.j2",
+    "stylesheets": ["css/bootstrap.min.css", "css/rstblog.css", "css/pygments.css"],
+    "scripts": ["js/search.js"],
+    "compress": [".css", ".js", ".json", ".svg", ".txt", ".html"],
+    # Hashed copies which are no longer current are kept this many days so
+    # that pages cached against an earlier build keep working
+    "retain_days": 7,
+}
+
+HASH_LENGTH = 10
+
+HASHED_RE = re.compile(rf"\.[0-9a-f]{{{HASH_LENGTH}}}\.[^.]+(\.gz|\.br)?$")
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def compress(path, data):
+    """
+    Writes the precompressed siblings of the file at path, returning their
+    names
+    """
+    written = []
+    gz = path.with_name(path.name + ".gz")
+    # mtime=0 keeps the output stable so unchanged inputs give identical bytes
+    write_atomic(gz, gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(gz.name)
+    if (brotli := _brotli()) is not None:
+        br = path.with_name(path.name + ".br")
+        write_atomic(br, brotli.compress(data, quality=11))
+        written.append(br.name)
+    return written
+
+
+def hashed_name(path, digest):
+    """
+    Inserts the digest before the suffix, e.g. rstblog.0123456789.css
+    """
+    return f"{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}"
+
+
+def build_file(source, relative, digest, output, settings):
+    """
+    Writes the hashed copy of a single static file and its compressed siblings,
+    returning the list of files written relative to the output
+    """
+    dst = output / relative.parent / hashed_name(relative, digest)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, dst)
+    files = [dst]
+    if source.suffix in settings["compress"]:
+        with open(source, "rb") as f:
+            siblings = compress(dst, f.read())
+        files.extend(dst.with_name(s) for s in siblings)
+    return [f.relative_to(output).as_posix() for f in files]
+
+
+def remove_retired(output, current, retired, now, retain):
+    """
+    Deletes the hashed copies which stopped being current more than retain
+    seconds ago. retired maps each copy which isn't current to the time it was
+    first found to be so, and the updated mapping is returned.
+    """
+    kept = {}
+    for f in sorted(output.rglob("*")):
+        if not f.is_file() or not HASHED_RE.search(f.name):
+            continue
+        name = f.relative_to(output).as_posix()
+        if name in current:
+            continue
+        since = retired.get(name, now)
+        if now - since > retain:
+            _log.info(
+                f"Removing {name}, superseded {(now - since) / 86400:.0f} days ago"
+            )
+            f.unlink()
+        else:
+            kept[name] = since
+    return kept
+
+
+def static_url(manifest, name, fallbacks):
+    """
+    Returns the URL of the hashed copy of a static file. A file which hasn't
+    been built (such as a pruned stylesheet before rstblog-prunecss has ran)
+    is replaced by the file it is generated from, if any.
+    """
+    if name in manifest:
+        return manifest[name]["url"]
+    if (source := fallbacks.get(name)) in manifest:
+        _log.warning(f"{name} hasn't been built, linking {source} instead")
+        return manifest[source]["url"]
+    raise ValueError(f"{name} is linked by static.j2 but isn't in the static sources")
+
+
+def render_include(manifest, settings, search_url="/search", fallbacks=None):
+    """
+    Renders the template included by base.j2 to link the stylesheets and
+    scripts. Scripts are told where to find the search index through their
+    data-index attribute. fallbacks maps generated files to their source.
+    """
+    fallbacks = fallbacks or {}
+    lines = ["{# Generated by rstblog-static. Do not edit. #}"]
+    for s in settings["stylesheets"]:
+        url = static_url(manifest, s, fallbacks)
+        lines.append(f'<link rel="stylesheet" type="text/css" href="{url}" />')
+    for s in settings["scripts"]:
+        url = static_url(manifest, s, fallbacks)
+        lines.append(f'<script defer src="{url}" data-index="{search_url}"></script>')
+    return "\n".join(lines) + "\n"
+
+
+def build(root=".", config=None):
+    """
+    Rebuilds the hashed copies of any static file whose content has changed
+    since the last build. Returns the manifest.
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    settings = dict(DEFAULT_SETTINGS, **config.get("static", {}))
+    output = root / settings["output"]
+    url = "/" + pathlib.PurePosixPath(settings["output"]).name
+    cache = JsonCache(cache_dir(config, root) / "static.json")
+    manifest = {}
+    current = set()
+    rebuilt = 0
+    for source_dir in (root / s for s in settings["sources"]):
+        if not source_dir.is_dir():
+            continue
+        for source in sorted(f for f in source_dir.rglob("*") if f.is_file()):
+            relative = source.relative_to(root)
+            name = relative.as_posix()
+            digest = file_hash(source)
+            entry = cache.get(name)
+            if (
+                entry is None
+                or entry["hash"] != digest
+                or not all((output / f).is_file() for f in entry["files"])
+            ):
+                _log.info(f"Building {name}")
+                files = build_file(source, relative, digest, output, settings)
+                entry = {
+                    "hash": digest,
+                    "files": files,
+                    "url": f"{url}/{files[0]}",
+                }
+                rebuilt += 1
+            cache.put(name, entry)
+            current.update(entry["files"])
+            manifest[name] = {"hash": digest, "url": entry["url"]}
+    retired = remove_retired(
+        output,
+        current,
+        cache.get("retired", {}),
+        time.time(),
+        settings["retain_days"] * 86400,
+    )
+    cache.put("retired", retired)
+    cache.save()
+    write_atomic(root / settings["manifest"], json.dumps(manifest, indent=1))
+    # rstblog serves the search output directory under its own name
+    search = config.get("search", {}).get("output", "./search")
+    search_url = "/" + pathlib.PurePosixPath(search).name
+    pruned = config.get("prune", {}).get("stylesheets", PRUNE_SETTINGS["stylesheets"])
+    fallbacks = dict((o, s) for s, o in pruned.items())
+    write_atomic(
+        root / settings["include"],
+        render_include(manifest, settings, search_url, fallbacks),
+    )
+    _log.info(f"{rebuilt} of {len(manifest)} static files rebuilt")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    if _brotli() is None:
+        _log.warning("brotli is not installed, only gzip siblings will be written")
+    build(args.root)
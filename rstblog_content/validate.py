@@ -0,0 +1,149 @@
+"""
+Validates every post and page by parsing it with docutils, reporting each
+problem with its file and line. Results are cached by file hash so that only
+documents which changed since the last run are parsed again.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import pathlib
+import sys
+
+from .cache import JsonCache, cache_dir, file_hash
+from .config import load_config, content_dirs
+from .content import find_documents
+
+_log = logging.getLogger(__name__)
+
+# docutils levels: 1 info, 2 warning, 3 error, 4 severe
+REPORT_LEVEL = 2
+ERROR_LEVEL = 3
+LEVEL_NAMES = {2: "WARNING", 3: "ERROR", 4: "SEVERE"}
+
+SETTINGS = {
+    # Problems are collected from the doctree rather than printed
+    "report_level": 5,
+    "halt_level": 5,
+    "warning_stream": False,
+    # Highlighting is rstblog's job and makes parsing much slower
+    "syntax_highlight": "none",
+    "file_insertion_enabled": False,
+    "raw_enabled": False,
+}
+
+
+def _docutils():
+    try:
+        import docutils
+    except ImportError:
+        raise RuntimeError("docutils must be installed to validate documents")
+    return docutils
+
+
+def register_directives():
+    """
+    Registers the directives rstblog adds to docutils, so that they validate
+    the same way they are rendered
+    """
+    from docutils.parsers.rst import Directive, directives
+    from docutils.parsers.rst.directives.body import CodeBlock
+
+    class RstblogSettings(Directive):
+        option_spec = {
+            "title": directives.unchanged_required,
+            "date": directives.unchanged_required,
+            "url": directives.unchanged_required,
+            "tags": directives.unchanged,
+        }
+
+        def run(self):
+            return []
+
+    class RstblogBreak(Directive):
+        def run(self):
+            return []
+
+    class RstblogCodeBlock(CodeBlock):
+        option_spec = dict(CodeBlock.option_spec, **{"height-limit": directives.flag})
+
+    directives.register_directive("rstblog-settings", RstblogSettings)
+    directives.register_directive("rstblog-break", RstblogBreak)
+    directives.register_directive("code-block", RstblogCodeBlock)
+
+
+def validate(path):
+    """
+    Parses a document, returning a list of (line, level, message) for every
+    problem docutils reports
+    """
+    from docutils import nodes
+    from docutils.core import publish_doctree
+
+    register_directives()
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    doctree = publish_doctree(
+        source, source_path=str(path), settings_overrides=SETTINGS
+    )
+    return [
+        (m.get("line"), m["level"], m.children[0].astext().strip())
+        for m in doctree.findall(nodes.system_message)
+        if m["level"] >= REPORT_LEVEL
+    ]
+
+
+def check(root=".", config=None, jobs=None):
+    """
+    Validates every document which changed since it was last validated,
+    returning a dict of document name (relative to the root) to its problems
+    """
+    root = pathlib.Path(root).resolve()
+    config = config if config is not None else load_config(root)
+    version = _docutils().__version__
+    cache = JsonCache(cache_dir(config, root) / "validate.json")
+    results = {}
+    stale = []
+    for path in find_documents(content_dirs(config, root)):
+        name = path.relative_to(root).as_posix()
+        digest = file_hash(path)
+        entry = cache.get(name)
+        if entry is None or entry["hash"] != digest or entry["docutils"] != version:
+            stale.append((path, name, digest))
+            continue
+        cache.put(name, entry)
+        results[name] = entry["messages"]
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            validated = pool.map(validate, [p for p, _, _ in stale])
+            for (path, name, digest), messages in zip(stale, validated):
+                cache.put(
+                    name, {"hash": digest, "docutils": version, "messages": messages}
+                )
+                results[name] = messages
+    cache.save()
+    _log.info(f"Validated {len(stale)} of {len(results)} documents")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--root", default=".", help="Path to the content repository")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel workers")
+
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig()
+    logging.getLogger().setLevel(level)
+
+    results = check(args.root, jobs=args.jobs)
+    errors = 0
+    for name, messages in sorted(results.items()):
+        for line, severity, message in messages:
+            log = _log.error if severity >= ERROR_LEVEL else _log.warning
+            log(f"{name}:{line or '?'}: {LEVEL_NAMES[severity]}: {message}")
+            errors += severity >= ERROR_LEVEL
+    if errors:
+        sys.exit(1)
@@ -0,0 +1,47 @@
+"""
+Checks that the regex HTML backend of import.py, which is the default, parses
+the corpus into exactly the same TagHandler trees as the stdlib backend
+"""
+
+import importlib.util
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+CORPUS = sorted((ROOT / "tests" / "corpus").glob("*.html"))
+
+
+def _load_importer():
+    # import.py is a script whose name is a keyword, so it's loaded by path
+    spec = importlib.util.spec_from_file_location(
+        "wordpress_import", ROOT / "import.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+importer = _load_importer()
+
+
+def parse(text, backend):
+    """
+    Parses the text with the passed backend, returning the signature of the
+    resulting tree or of the error raised along with where it was raised
+    """
+    content = importer.WordpressToRst(backend)
+    try:
+        content.feed(text)
+        content.close()
+        tree = (content.content, content.stack)
+    except ValueError as e:
+        tree = (str(e), content.getpos())
+    return importer.tree_signature(tree)
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=lambda p: p.name)
+def test_backends_agree(path):
+    text = path.read_bytes().decode("utf-8")
+    expected = parse(text, "stdlib")
+    assert parse(text, "regex") == expected
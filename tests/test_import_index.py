@@ -0,0 +1,130 @@
+"""
+Checks that the ItemIndex of import.py finds the same items as parsing the
+whole export, and that it is rebuilt when the export changes
+"""
+
+import datetime
+import importlib.util
+import json
+import os
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+HEADER = """<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0"
+    xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"
+    xmlns:content="http://purl.org/rss/1.0/modules/content/"
+    xmlns:wfw="http://wellformedweb.org/CommentAPI/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:wp="http://wordpress.org/export/1.2/">
+<channel>
+<title>Test</title>
+"""
+
+
+def _load_importer():
+    # import.py is a script whose name is a keyword, so it's loaded by path
+    spec = importlib.util.spec_from_file_location(
+        "wordpress_import", ROOT / "import.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+importer = _load_importer()
+
+
+def item(post_id, slug, post_type="post", status="publish", date="2020-01-02"):
+    """
+    Export item with a body which contains markup the index must skip over
+    """
+    extra = ""
+    if post_type == "attachment":
+        url = f"https://example.com/uploads/{slug}.png"
+        extra = f"""<wp:attachment_url>{url}</wp:attachment_url>
+<wp:postmeta>
+<wp:meta_key><![CDATA[_wp_attached_file]]></wp:meta_key>
+<wp:meta_value><![CDATA[{slug}.png]]></wp:meta_value>
+</wp:postmeta>
+"""
+    return f"""<item>
+<title>{slug.title()}</title>
+<link>https://example.com/{slug}/</link>
+<guid isPermaLink="false">https://example.com/?p={post_id}</guid>
+<content:encoded><![CDATA[<p>Not an <item> or a <guid>x</guid></p>]]></content:encoded>
+<wp:post_id>{post_id}</wp:post_id>
+<wp:post_date><![CDATA[{date} 03:04:05]]></wp:post_date>
+<wp:post_modified><![CDATA[{date} 03:04:05]]></wp:post_modified>
+<wp:post_name><![CDATA[{slug}]]></wp:post_name>
+<wp:status><![CDATA[{status}]]></wp:status>
+<wp:post_type><![CDATA[{post_type}]]></wp:post_type>
+{extra}</item>
+"""
+
+
+def write_export(path, *items):
+    path.write_text(HEADER + "".join(items) + "</channel>\n</rss>\n")
+    return path
+
+
+@pytest.fixture
+def export(tmp_path):
+    return write_export(
+        tmp_path / "export.xml",
+        item(1, "first"),
+        item(2, "diagram", post_type="attachment", status="inherit"),
+        item(3, "about", post_type="page", date="2021-05-06"),
+        item(4, "unfinished", status="draft", date="2022-07-08"),
+    )
+
+
+def summary(items):
+    return [(i.guid, type(i).__name__, i.status, i.title) for i in items]
+
+
+def test_select_matches_parse_rss(export):
+    items = importer.parse_rss(export)
+    index = importer.ItemIndex(export)
+    content = [i for i in items if isinstance(i, importer.Content)]
+    assert summary(index.select()) == summary(content)
+    assert summary(index.select(only=["about"])) == summary(content[1:2])
+    since = datetime.date(2021, 1, 1)
+    assert summary(index.select(since=since)) == summary(content[1:])
+
+
+def test_find_attachment_matches_parse_rss(export):
+    items = importer.parse_rss(export)
+    index = importer.ItemIndex(export)
+    (attachment,) = [i for i in items if isinstance(i, importer.Attachment)]
+    for key in attachment.keys:
+        assert summary(index.find("attachment", key)) == summary([attachment])
+    assert index.find("attachment", "https://example.com/first/") == []
+
+
+def test_index_rebuilt_when_export_changes(export, monkeypatch):
+    importer.ItemIndex(export)
+    saved = json.loads(export.with_name("export.xml.index.json").read_text())
+
+    # An unchanged export reuses the saved index
+    def scan(self):
+        raise AssertionError("the export was indexed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(importer.ItemIndex, "scan", scan)
+        importer.ItemIndex(export)
+
+    # Touching the export rebuilds it even though its size is the same
+    stat = export.stat()
+    os.utime(export, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    importer.ItemIndex(export)
+    touched = json.loads(export.with_name("export.xml.index.json").read_text())
+    assert touched["stamp"] != saved["stamp"]
+    assert touched["items"] == saved["items"]
+
+    write_export(export, item(1, "first"), item(5, "second"))
+    index = importer.ItemIndex(export)
+    assert summary(index.select()) == summary(importer.parse_rss(export))